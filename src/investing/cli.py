@@ -73,6 +73,11 @@ command arguments from. If command line arguments are provided, they will
 override the loaded ones."""
 PIPELINE_ARG_HELP = """Name of the modular pipeline to run.
 If not set, the project pipeline is run by default."""
+REFRESH_UNIVERSE_HELP = """Re-download the investpy stock, etf and index lists, even if
+the cached lists have not expired yet."""
+QUEUE_ARG_HELP = """Path of the SQLite work queue to process tasks from. If not
+specified, prophet_params.executor.queue.path is read from the configuration."""
+WORKERS_ARG_HELP = """Number of worker processes to start on this machine."""
 PARAMS_ARG_HELP = """Specify extra parameters that you want to pass
 to the context initializer. Items must be separated by comma, keys - by colon,
 example: param1:value1,param2:value2. Each parameter is split by the first comma,
@@ -194,6 +199,9 @@ def cli():
 @click.option(
     "--params", type=str, default="", help=PARAMS_ARG_HELP, callback=_split_params
 )
+@click.option(
+    "--refresh-universe", is_flag=True, multiple=False, help=REFRESH_UNIVERSE_HELP
+)
 def run(
     tag,
     env,
@@ -208,6 +216,7 @@ def run(
     pipeline,
     config,
     params,
+    refresh_universe,
 ):
     """Run the pipeline."""
     if parallel and runner:
@@ -222,6 +231,8 @@ def run(
 
     tag = _get_values_as_tuple(tag) if tag else tag
     node_names = _get_values_as_tuple(node_names) if node_names else node_names
+    if refresh_universe:
+        params = {**params, "refresh_universe": True}
 
     package_name = str(Path(__file__).resolve().parent.name)
     with KedroSession.create(package_name, env=env, extra_params=params) as session:
@@ -237,6 +248,22 @@ def run(
         )
 
 
+@cli.command()
+@env_option
+@click.option("--queue", "queue_path", type=str, default=None, help=QUEUE_ARG_HELP)
+@click.option("--workers", "-w", type=int, default=1, help=WORKERS_ARG_HELP)
+def worker(env, queue_path, workers):
+    """Process forecasting tasks published to the work queue by a pipeline
+    run with prophet_params.executor.mode set to 'queue'."""
+    from investing.pipelines.prophet_model.work_queue import run_workers
+
+    package_name = str(Path(__file__).resolve().parent.name)
+    with KedroSession.create(package_name, env=env) as session:
+        queue_params = session.load_context().params["prophet_params"]["executor"]["queue"]
+
+    run_workers(queue_path or queue_params["path"], workers, queue_params["poll_seconds"])
+
+
 cli.add_command(pipeline_group)
 cli.add_command(catalog_group)
 cli.add_command(jupyter_group)
@@ -0,0 +1,86 @@
+"""Local on-disk cache for slowly changing tables."""
+import logging
+import time
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, Callable, Dict, Union
+
+import pandas as pd
+from kedro.io import AbstractDataSet, DataSetError
+
+log = logging.getLogger(__name__)
+
+
+class TTLCacheDataSet(AbstractDataSet):
+    """Stores a ``pandas.DataFrame`` as a compressed pickle on local disk,
+    which is considered fresh for ``ttl_days`` after it was written.
+
+    Saving a callable (e.g. an unevaluated download function returned by a
+    node) only calls it, and rewrites the cache, when the cache is missing or
+    stale. Saving a ``DataFrame`` always overwrites the cache, which is how
+    a refresh is forced.
+
+    Example:
+    ::
+
+        >>> investpy_etfs:
+        >>>   type: investing.extras.datasets.cache_dataset.TTLCacheDataSet
+        >>>   filepath: data/01_raw/investpy_etfs.pkl.gz
+        >>>   ttl_days: 7
+    """
+
+    DEFAULT_SAVE_ARGS = {"compression": "infer"}
+    DEFAULT_LOAD_ARGS = {"compression": "infer"}
+
+    def __init__(
+        self,
+        filepath: str,
+        ttl_days: float = 7,
+        load_args: Dict[str, Any] = None,
+        save_args: Dict[str, Any] = None,
+    ):
+        """Creates a new instance of ``TTLCacheDataSet``.
+
+        Args:
+            filepath: Local path of the pickle file; compression is inferred
+                from the suffix, e.g. ``.pkl.gz``.
+            ttl_days: Age in days after which the cache is stale.
+            load_args: Passed to ``pandas.read_pickle``.
+            save_args: Passed to ``pandas.DataFrame.to_pickle``.
+        """
+        self._filepath = Path(filepath)
+        self._ttl = ttl_days * 24 * 60 * 60
+        self._load_args = {**deepcopy(self.DEFAULT_LOAD_ARGS), **(load_args or {})}
+        self._save_args = {**deepcopy(self.DEFAULT_SAVE_ARGS), **(save_args or {})}
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._filepath.exists()
+            and time.time() - self._filepath.stat().st_mtime < self._ttl
+        )
+
+    def _load(self) -> pd.DataFrame:
+        if not self._filepath.exists():
+            raise DataSetError(f"No cached data found at `{self._filepath}`")
+        return pd.read_pickle(self._filepath, **self._load_args)
+
+    def _save(self, data: Union[pd.DataFrame, Callable[[], pd.DataFrame]]) -> None:
+        if callable(data):
+            if self._is_fresh():
+                log.info(f"Using cached data, not yet expired: {self._filepath}")
+                return
+            data = data()
+
+        self._filepath.parent.mkdir(parents=True, exist_ok=True)
+        data.to_pickle(self._filepath, **self._save_args)
+
+    def _exists(self) -> bool:
+        return self._filepath.exists()
+
+    def _describe(self) -> Dict[str, Any]:
+        return dict(
+            filepath=self._filepath,
+            ttl_days=self._ttl / (24 * 60 * 60),
+            load_args=self._load_args,
+            save_args=self._save_args,
+        )
@@ -0,0 +1,570 @@
+"""Partitioned datasets used by the investing pipelines."""
+import hashlib
+import json
+import operator
+import os
+import posixpath
+from copy import deepcopy
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Tuple, Union
+
+import fsspec
+from fsspec.implementations.local import LocalFileSystem
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from kedro.io import AbstractDataSet, DataSetError, PartitionedDataSet
+from kedro.io.core import get_protocol_and_path
+
+_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+def _read_jsonl(filesystem: fsspec.AbstractFileSystem, path: str) -> Tuple[Dict[str, Dict], int]:
+    """Read a JSON-lines file of partition entries into a ``{partition_id: entry}``
+    mapping, and count its lines. Later lines take precedence, so entries are
+    updated by appending."""
+    if not filesystem.exists(path):
+        return {}, 0
+
+    entries, lines = {}, 0
+    with filesystem.open(path, mode="r") as fs_file:
+        for line in fs_file:
+            if line.strip():
+                entry = json.loads(line)
+                entries[entry.pop("partition")] = entry
+                lines += 1
+    return entries, lines
+
+
+def _read_manifest(filesystem: fsspec.AbstractFileSystem, path: str) -> Dict[str, Dict]:
+    return _read_jsonl(filesystem, path)[0]
+
+
+def _append_jsonl(filesystem: fsspec.AbstractFileSystem, path: str, entry: Dict) -> None:
+    with filesystem.open(path, mode="a") as fs_file:
+        fs_file.write(json.dumps(entry, default=str) + "\n")
+
+
+def _compact_jsonl(filesystem: fsspec.AbstractFileSystem, path: str) -> None:
+    """Rewrite a JSON-lines file with one line per partition, once superseded
+    entries make up more than half of it."""
+    entries, lines = _read_jsonl(filesystem, path)
+    if lines <= 2 * len(entries):
+        return
+
+    with filesystem.open(path, mode="w") as fs_file:
+        for partition_id, entry in sorted(entries.items()):
+            line = json.dumps({"partition": partition_id, **entry}, default=str)
+            fs_file.write(line + "\n")
+
+
+def _replace(filesystem: fsspec.AbstractFileSystem, source: str, target: str) -> None:
+    """Move a completely written file over its target: an atomic rename on
+    local filesystems; elsewhere a copy, as object stores replace whole objects."""
+    if isinstance(filesystem, LocalFileSystem):
+        strip = filesystem._strip_protocol  # pylint: disable=protected-access
+        os.replace(strip(source), strip(target))
+    else:
+        filesystem.mv(source, target)
+
+
+def row_hash_sum(data: pd.DataFrame) -> int:
+    """Sum of the hashes of a ``DataFrame``'s rows (values only, not the index),
+    wrapping at 2**64. Unlike a hash of the whole content, it is additive: the
+    sum of rows already seen plus the sum of the rest gives the total, so a
+    reader can check that the rows it processed before are unchanged."""
+    return int(pd.util.hash_pandas_object(data, index=False).to_numpy().sum(dtype="uint64"))
+
+
+def _partition_stats(data: Any, date_column: str = None) -> Dict[str, Any]:
+    """Row count, date range and content hash of a partition, for the manifest."""
+    if not isinstance(data, pd.DataFrame):
+        content = json.dumps(data, sort_keys=True, default=str).encode()
+        return {"hash": hashlib.sha1(content).hexdigest()}
+
+    content = pd.util.hash_pandas_object(data).values
+    stats = {
+        "rows": len(data),
+        "hash": hashlib.sha1(content).hexdigest(),
+        "row_hash_sum": row_hash_sum(data),
+    }
+
+    if date_column in data:
+        dates = pd.to_datetime(data[date_column])
+    elif date_column and data.index.name == date_column:
+        dates = pd.to_datetime(data.index)
+    else:
+        return stats
+
+    if len(dates):
+        stats["min_date"] = dates.min().strftime("%Y-%m-%d")
+        stats["max_date"] = dates.max().strftime("%Y-%m-%d")
+    return stats
+
+
+class OptionalPartitionedDataSet(PartitionedDataSet):
+    """``PartitionedDataSet`` which loads an empty dictionary, rather than
+    raising, when the directory holds no partitions yet.
+
+    Used to read back previously saved partitions, e.g. for incremental
+    downloads, where the very first run starts from an empty directory.
+
+    Example:
+    ::
+
+        >>> etf_historical_stored:
+        >>>   type: investing.extras.datasets.partitioned_dataset.OptionalPartitionedDataSet
+        >>>   path: data/01_raw/historic
+        >>>   filename_suffix: ".csv"
+        >>>   dataset: pandas.CSVDataSet
+    """
+
+    def _load(self) -> Dict[str, Callable[[], Any]]:
+        if not self._list_partitions():
+            return {}
+        return super()._load()
+
+
+class StreamingPartitionedDataSet(OptionalPartitionedDataSet):
+    """``PartitionedDataSet`` which writes each partition as soon as it is
+    produced, and records each saved partition in a JSON-lines manifest
+    stored alongside the partitions.
+
+    Besides a dictionary, ``save`` accepts any iterable (e.g. a generator
+    returned by a node) of ``(partition_id, data)`` or
+    ``(partition_id, data, meta)`` tuples, so only one partition needs to be
+    held in memory. Each manifest entry holds the partition path, the date it
+    was saved, its row count, min and max ``date_column`` value and content
+    hash and ``row_hash_sum``, plus the optional ``meta`` dictionary, all
+    describing the data as stored. The manifest can be read
+    back with ``ManifestDataSet``, e.g. to skip partitions already completed
+    today when resuming an interrupted run.
+
+    An item whose data is ``None`` records a failed partition: nothing is
+    written, and its ``meta`` is appended to a separate JSON-lines
+    ``failures`` log, together with the number of consecutive runs the
+    partition has failed; a later successful save resets the count to 0.
+    The log can also be read with ``ManifestDataSet``.
+
+    With ``use_manifest``, partitions are listed from the manifest instead of
+    the filesystem, and ``partition_filters`` select partitions on their
+    manifest entries, e.g. ``[["max_date", ">=", "2021-01-01"]]``, so
+    filtered partitions are never opened.
+
+    Example:
+    ::
+
+        >>> etf_information_raw:
+        >>>   type: investing.extras.datasets.partitioned_dataset.StreamingPartitionedDataSet
+        >>>   path: data/01_raw/information
+        >>>   filename_suffix: ".json"
+        >>>   dataset: json.JSONDataSet
+        >>>   use_manifest: True
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *args,
+        manifest: str = "_manifest.jsonl",
+        failures: str = "_failures.jsonl",
+        date_column: str = None,
+        use_manifest: bool = False,
+        partition_filters: List[Tuple] = None,
+        **kwargs,
+    ):
+        """Creates a new instance of ``StreamingPartitionedDataSet``.
+
+        Args:
+            *args: Positional arguments passed to ``PartitionedDataSet``.
+            manifest: Name of the manifest file, relative to ``path``.
+            failures: Name of the failures log, relative to ``path``.
+            date_column: Column, or index name, whose range is recorded in
+                the manifest as ``min_date`` and ``max_date``.
+            use_manifest: List partitions from the manifest rather than
+                the filesystem.
+            partition_filters: ``[field, operator, value]`` conditions on
+                manifest entries, which partitions must all satisfy to be
+                loaded; operators are ``==``, ``!=``, ``<``, ``<=``, ``>``
+                and ``>=``.
+            **kwargs: Keyword arguments passed to ``PartitionedDataSet``.
+        """
+        super().__init__(*args, **kwargs)
+        self._manifest = manifest
+        self._manifest_path = posixpath.join(self._normalized_path, manifest)
+        self._failures = failures
+        self._failures_path = posixpath.join(self._normalized_path, failures)
+        self._date_column = date_column
+        self._use_manifest = use_manifest or bool(partition_filters)
+        self._partition_filters = [tuple(f) for f in partition_filters or []]
+
+    def _selected(self, entry: Dict[str, Any]) -> bool:
+        for field, op, value in self._partition_filters:
+            actual = entry.get(field)
+            if actual is None:
+                return False
+            if isinstance(actual, str):
+                value = str(value)
+            if not _OPERATORS[op](actual, value):
+                return False
+        return True
+
+    def _list_partitions(self) -> List[str]:
+        if self._use_manifest:
+            manifest = _read_manifest(self._filesystem, self._manifest_path)
+            # same form as filesystem listings, as expected by `_path_to_partition`
+            strip = self._filesystem._strip_protocol  # pylint: disable=protected-access
+            return [
+                strip(self._partition_to_path(partition_id))
+                for partition_id, entry in sorted(manifest.items())
+                if self._selected(entry)
+            ]
+
+        return [
+            path
+            for path in super()._list_partitions()
+            if posixpath.basename(path) not in (self._manifest, self._failures)
+        ]
+
+    def _prepare(self, data: Any) -> Any:
+        """Partition data in the form it is stored, and described by the manifest."""
+        return data
+
+    def _save_partition(self, partition_id: str, data: Any) -> None:
+        """Write the partition to a hidden temporary file next to it, moved into
+        place once complete, so a killed run never leaves a truncated partition."""
+        kwargs = deepcopy(self._dataset_config)
+        partition = self._partition_to_path(partition_id)
+        directory, name = posixpath.split(partition)
+        temporary = posixpath.join(directory, f".{name}.tmp")
+        # not every writer creates parent directories, e.g. pyarrow on local paths
+        self._filesystem.makedirs(directory, exist_ok=True)
+        # join the protocol back since tools like PySpark may rely on it
+        kwargs[self._filepath_arg] = self._join_protocol(temporary)
+        dataset = self._dataset_type(**kwargs)  # type: ignore
+        dataset.save(data)
+        _replace(self._filesystem, temporary, partition)
+
+    def _record(self, partition_id: str, data: Any, meta: Dict[str, Any]) -> Dict[str, Any]:
+        entry = {
+            "partition": partition_id,
+            "saved": pd.Timestamp.today().strftime("%Y-%m-%d"),
+            "path": self._partition_to_path(partition_id),
+            **_partition_stats(data, self._date_column),
+            **meta,
+        }
+        _append_jsonl(self._filesystem, self._manifest_path, entry)
+        return entry
+
+    def _record_failure(self, partition_id: str, failures: int, meta: Dict[str, Any]) -> None:
+        entry = {
+            "partition": partition_id,
+            "saved": pd.Timestamp.today().strftime("%Y-%m-%d"),
+            "failures": failures,
+            **meta,
+        }
+        _append_jsonl(self._filesystem, self._failures_path, entry)
+
+    def _compact(self) -> None:
+        _compact_jsonl(self._filesystem, self._manifest_path)
+        _compact_jsonl(self._filesystem, self._failures_path)
+
+    def _save(
+        self, data: Union[Dict[str, Any], Iterable[Tuple]]
+    ) -> None:
+        items = sorted(data.items()) if isinstance(data, dict) else data
+        failed = _read_manifest(self._filesystem, self._failures_path)
+        saved = False
+        try:
+            for partition_id, partition_data, *meta in items:
+                meta = meta[0] if meta else {}
+                count = failed.get(partition_id, {}).get("failures", 0)
+                if partition_data is None:
+                    self._record_failure(partition_id, count + 1, meta)
+                    failed[partition_id] = {"failures": count + 1}
+                    continue
+
+                partition_data = self._prepare(partition_data)
+                self._save_partition(partition_id, partition_data)
+                self._record(partition_id, partition_data, meta)
+                if count:
+                    self._record_failure(partition_id, 0, {})
+                    failed[partition_id] = {"failures": 0}
+                saved = True
+        finally:
+            if saved:
+                self._compact()
+            self._invalidate_caches()
+
+    def _describe(self) -> Dict[str, Any]:
+        return dict(
+            super()._describe(),
+            manifest=self._manifest,
+            failures=self._failures,
+            use_manifest=self._use_manifest,
+            partition_filters=self._partition_filters,
+        )
+
+
+class SnapshotPartitionedDataSet(StreamingPartitionedDataSet):
+    """``StreamingPartitionedDataSet`` of JSON-serialisable partitions (e.g.
+    ``json.JSONDataSet``) which also maintains a consolidated JSON-lines
+    snapshot of all partitions, appended to as each partition is saved.
+
+    On load the snapshot is read once, sequentially, and serves every
+    partition whose content hash matches the manifest; only the remaining
+    partitions are loaded from their own files.
+
+    Example:
+    ::
+
+        >>> etf_information_raw:
+        >>>   type: investing.extras.datasets.partitioned_dataset.SnapshotPartitionedDataSet
+        >>>   path: data/01_raw/information
+        >>>   filename_suffix: ".json"
+        >>>   dataset: json.JSONDataSet
+        >>>   use_manifest: True
+    """
+
+    def __init__(self, *args, snapshot: str = "_snapshot.jsonl", **kwargs):
+        """Creates a new instance of ``SnapshotPartitionedDataSet``.
+
+        Args:
+            *args: Positional arguments passed to ``StreamingPartitionedDataSet``.
+            snapshot: Name of the snapshot file, relative to ``path``.
+            **kwargs: Keyword arguments passed to ``StreamingPartitionedDataSet``.
+        """
+        super().__init__(*args, **kwargs)
+        self._snapshot = snapshot
+        self._snapshot_path = posixpath.join(self._normalized_path, snapshot)
+
+    def _list_partitions(self) -> List[str]:
+        return [
+            path
+            for path in super()._list_partitions()
+            if posixpath.basename(path) != self._snapshot
+        ]
+
+    def _load(self) -> Dict[str, Callable[[], Any]]:
+        loaders = super()._load()
+
+        manifest = _read_manifest(self._filesystem, self._manifest_path)
+        snapshot, _ = _read_jsonl(self._filesystem, self._snapshot_path)
+        for partition_id, entry in snapshot.items():
+            current = manifest.get(partition_id, {}).get("hash")
+            if partition_id in loaders and entry["hash"] == current:
+                loaders[partition_id] = partial(deepcopy, entry["data"])
+
+        return loaders
+
+    def _record(self, partition_id: str, data: Any, meta: Dict[str, Any]) -> Dict[str, Any]:
+        entry = super()._record(partition_id, data, meta)
+        snapshot = {"partition": partition_id, "hash": entry["hash"], "data": data}
+        _append_jsonl(self._filesystem, self._snapshot_path, snapshot)
+        return entry
+
+    def _compact(self) -> None:
+        super()._compact()
+        _compact_jsonl(self._filesystem, self._snapshot_path)
+
+    def _describe(self) -> Dict[str, Any]:
+        return dict(super()._describe(), snapshot=self._snapshot)
+
+
+class ParquetPartitionedDataSet(StreamingPartitionedDataSet):
+    """``StreamingPartitionedDataSet`` storing partitions as a single
+    hive-partitioned Parquet dataset, ``<path>/<key>=<partition_id>/part.parquet``.
+
+    On save a named index (e.g. ``Date`` or ``ds``) is kept as a column, as
+    saving a CSV with ``index: True`` does, date columns are stored as
+    timestamps and float columns as ``float_dtype``. Loads only read the
+    requested ``columns`` and skip row groups excluded by ``filters``
+    (predicate pushdown). With ``concat`` the whole dataset is loaded in a
+    single read as one ``DataFrame``, with the partition id in column
+    ``key``, rather than as a dictionary of partition loaders; with
+    ``use_manifest`` that read is pruned to the partitions listed in the
+    manifest. With ``lazy`` as well, the load returns the reading function
+    instead, so a node reads only the ``partitions`` it needs, still in a
+    single read, e.g. ``read(partitions=["a", "b"])``. Partition
+    loaders, and the lazy read, accept further ``columns`` and ``filters``,
+    e.g. ``loader(filters=[("Date", ">=", start)])`` reads only the rows needed.
+
+    Example:
+    ::
+
+        >>> etf_historical:
+        >>>   type: investing.extras.datasets.partitioned_dataset.ParquetPartitionedDataSet
+        >>>   path: data/01_raw/historic_parquet
+        >>>   key: symbol
+        >>>   date_columns: [Date]
+        >>>   filters: [[Date, ">=", 2015-01-01]]
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        path: str,
+        key: str = "symbol",
+        columns: List[str] = None,
+        filters: List[Tuple] = None,
+        date_columns: List[str] = None,
+        float_dtype: str = "float64",
+        concat: bool = False,
+        lazy: bool = False,
+        manifest: str = "_manifest.jsonl",
+        failures: str = "_failures.jsonl",
+        use_manifest: bool = False,
+        partition_filters: List[Tuple] = None,
+        credentials: Dict[str, Any] = None,
+        fs_args: Dict[str, Any] = None,
+    ):
+        """Creates a new instance of ``ParquetPartitionedDataSet``.
+
+        Args:
+            path: Root directory of the Parquet dataset.
+            key: Name of the hive partitioning key holding the partition id.
+            columns: Columns to load, all when not set.
+            filters: Row filters in ``pyarrow.parquet.read_table`` format,
+                e.g. ``[["Date", ">=", "2015-01-01"]]``.
+            date_columns: Columns converted to timestamps on save; the range
+                of the first is recorded in the manifest.
+            float_dtype: Dtype float columns are stored as on save.
+            concat: Load the whole dataset as one ``DataFrame``.
+            lazy: With ``concat``, load the function reading it instead.
+            manifest: Name of the manifest file, relative to ``path``.
+            failures: Name of the failures log, relative to ``path``.
+            use_manifest: List partitions from the manifest rather than
+                the filesystem.
+            partition_filters: Conditions on manifest entries selecting
+                the partitions to load, see ``StreamingPartitionedDataSet``.
+            credentials: Protocol-specific options passed to ``fsspec``.
+            fs_args: Extra arguments passed to the ``fsspec`` filesystem.
+        """
+        super().__init__(
+            path=path,
+            dataset="pandas.ParquetDataSet",
+            filename_suffix="/part.parquet",
+            credentials=credentials,
+            fs_args=fs_args,
+            manifest=manifest,
+            failures=failures,
+            date_column=date_columns[0] if date_columns else None,
+            use_manifest=use_manifest,
+            partition_filters=partition_filters,
+        )
+        self._key = key
+        self._columns = columns
+        self._filters = [tuple(f) for f in filters] if filters else None
+        self._date_columns = date_columns or []
+        self._float_dtype = float_dtype
+        self._concat = concat
+        self._lazy = lazy
+
+    def _partition_to_path(self, path: str) -> str:
+        return super()._partition_to_path(f"{self._key}={path}")
+
+    def _path_to_partition(self, path: str) -> str:
+        return super()._path_to_partition(path).split("=", 1)[-1]
+
+    def _read(
+        self, path: str, columns: List[str] = None, filters: List[Tuple] = None, **kwargs
+    ) -> pd.DataFrame:
+        table = pq.read_table(
+            path,
+            columns=columns or self._columns,
+            filters=[*(self._filters or []), *map(tuple, filters or [])] or None,
+            filesystem=self._filesystem,
+            **kwargs,
+        )
+        return table.to_pandas()
+
+    def _read_concat(
+        self, partitions: List[str] = None, columns: List[str] = None, filters: List[Tuple] = None
+    ) -> pd.DataFrame:
+        """The given partitions (all when not set) in a single read, with the partition id in column ``key``."""
+        if self._use_manifest:
+            listed = [self._path_to_partition(path) for path in self._list_partitions()]
+            partitions = listed if partitions is None else sorted(set(partitions) & set(listed))
+        if partitions is not None and not partitions:
+            return pd.DataFrame()
+
+        # partition pruning: only the partitions read are opened
+        pruning = [(self._key, "in", list(partitions))] if partitions is not None else []
+        columns = columns or self._columns
+        columns = columns and [*columns, self._key]
+        # partition ids are read as strings, however they look
+        partitioning = ds.partitioning(pa.schema([(self._key, pa.string())]), flavor="hive")
+        data = self._read(
+            self._normalized_path, columns, [*pruning, *(filters or [])], partitioning=partitioning
+        )
+        data[self._key] = data[self._key].astype(str)
+        return data
+
+    def _load(self) -> Union[pd.DataFrame, Callable, Dict[str, Callable[[], Any]]]:
+        if self._concat:
+            return self._read_concat if self._lazy else self._read_concat()
+
+        return {
+            self._path_to_partition(path): partial(self._read, path)
+            for path in self._list_partitions()
+        }
+
+    def _prepare(self, data: pd.DataFrame) -> pd.DataFrame:
+        if data.index.name is not None:
+            data = data.reset_index()
+        for column in self._date_columns:
+            if column in data:
+                data[column] = pd.to_datetime(data[column])
+        floats = data.select_dtypes("floating").columns
+        return data.astype({column: self._float_dtype for column in floats})
+
+    def _describe(self) -> Dict[str, Any]:
+        return dict(
+            super()._describe(),
+            key=self._key,
+            columns=self._columns,
+            filters=self._filters,
+            concat=self._concat,
+            lazy=self._lazy,
+        )
+
+
+class ManifestDataSet(AbstractDataSet):
+    """Read-only access to the manifest, or failures log, written by
+    ``StreamingPartitionedDataSet``, as a ``{partition_id: entry}``
+    dictionary; empty when nothing has been saved yet.
+
+    Example:
+    ::
+
+        >>> etf_historical_manifest:
+        >>>   type: investing.extras.datasets.partitioned_dataset.ManifestDataSet
+        >>>   filepath: data/01_raw/historic/_manifest.jsonl
+    """
+
+    def __init__(self, filepath: str, fs_args: Dict[str, Any] = None):
+        protocol, path = get_protocol_and_path(filepath)
+        self._protocol = protocol
+        self._filepath = path
+        self._fs = fsspec.filesystem(protocol, **(fs_args or {}))
+
+    def _load(self) -> Dict[str, Dict]:
+        return _read_manifest(self._fs, self._filepath)
+
+    def _save(self, data: Any) -> None:
+        raise DataSetError(
+            f"{self.__class__.__name__} is read-only, the manifest is "
+            f"written by StreamingPartitionedDataSet on save"
+        )
+
+    def _exists(self) -> bool:
+        return self._fs.exists(self._filepath)
+
+    def _describe(self) -> Dict[str, Any]:
+        return dict(filepath=self._filepath, protocol=self._protocol)
@@ -0,0 +1,321 @@
+"""Append-only, memory-mapped store for daily OHLCV price series."""
+import os
+import shutil
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from fsspec.implementations.local import LocalFileSystem
+from kedro.io import AbstractDataSet
+
+from .partitioned_dataset import (
+    _append_jsonl,
+    _compact_jsonl,
+    _partition_stats,
+    _read_manifest,
+)
+
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def _date_bounds(dates: np.ndarray, filters: List[Tuple]) -> Tuple[int, int]:
+    """Row range satisfying ``Date`` filters, located by binary search on the
+    sorted date index; days are compared, as only days are stored."""
+    lo, hi = 0, len(dates)
+    for column, op, value in filters:
+        if column != "Date":
+            raise ValueError(f"Series can only be filtered on `Date`, not `{column}`")
+        day = np.datetime64(pd.Timestamp(value), "D")
+        if op in (">=", ">", "=="):
+            lo = max(lo, dates.searchsorted(day, "right" if op == ">" else "left"))
+        if op in ("<=", "<", "=="):
+            hi = min(hi, dates.searchsorted(day, "left" if op == "<" else "right"))
+        if op not in (">=", ">", "==", "<=", "<"):
+            raise ValueError(f"Unsupported `Date` filter operator `{op}`")
+    return lo, max(lo, hi)
+
+
+class TimeSeries:
+    """One symbol of an ``OHLCVStoreDataSet``: a sorted ``datetime64[D]``
+    date index and a float64 ``(rows, 5)`` OHLCV array, each a raw binary
+    file read through ``numpy.memmap``, so only the rows accessed are read.
+
+    Calling the object loads the series as a ``DataFrame`` with a ``Date``
+    column, accepting ``columns`` and ``Date`` ``filters`` like the loaders
+    of a ``ParquetPartitionedDataSet``.
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self._dir = Path(directory)
+        self._dates_path = self._dir / "dates.i8"
+        self._values_path = self._dir / "values.f8"
+        self._previous = self._dir.with_name(f".{self._dir.name}.old")
+        if self._previous.exists() and not self._dir.exists():
+            os.replace(self._previous, self._dir)  # a rewrite killed while swapping in
+
+    def __len__(self) -> int:
+        # rows are appended values first, so an interrupted append is ignored
+        if not (self._dates_path.exists() and self._values_path.exists()):
+            return 0
+        n_dates = self._dates_path.stat().st_size // 8
+        n_values = self._values_path.stat().st_size // (8 * len(COLUMNS))
+        return min(n_dates, n_values)
+
+    def _dates(self) -> np.ndarray:
+        rows = len(self)
+        if not rows:
+            return np.empty(0, dtype="datetime64[D]")
+        dates = np.memmap(self._dates_path, dtype="int64", mode="r", shape=(rows,))
+        return dates.view("datetime64[D]")
+
+    def _values(self) -> np.ndarray:
+        rows = len(self)
+        if not rows:
+            return np.empty((0, len(COLUMNS)), dtype="float64")
+        return np.memmap(
+            self._values_path, dtype="float64", mode="r", shape=(rows, len(COLUMNS))
+        )
+
+    @staticmethod
+    def _frame(dates: np.ndarray, values: np.ndarray) -> pd.DataFrame:
+        data = pd.DataFrame(np.array(values), columns=COLUMNS)
+        data.insert(0, "Date", pd.to_datetime(np.array(dates)))
+        return data
+
+    def first_date(self) -> Optional[pd.Timestamp]:
+        dates = self._dates()
+        return pd.Timestamp(dates[0]) if len(dates) else None
+
+    def last_date(self) -> Optional[pd.Timestamp]:
+        dates = self._dates()
+        return pd.Timestamp(dates[-1]) if len(dates) else None
+
+    def latest(self, rows: int = 1) -> pd.DataFrame:
+        """Last rows of the series, without reading the rest."""
+        start = max(len(self) - rows, 0)
+        return self._frame(self._dates()[start:], self._values()[start:])
+
+    def slice(self, start: Any = None, end: Any = None) -> pd.DataFrame:
+        """Rows dated between start and end inclusive."""
+        filters = [("Date", ">=", start)] if start is not None else []
+        filters += [("Date", "<=", end)] if end is not None else []
+        return self(filters=filters)
+
+    def __call__(self, columns: List[str] = None, filters: List[Tuple] = None) -> pd.DataFrame:
+        dates = self._dates()
+        lo, hi = _date_bounds(dates, filters or [])
+        data = self._frame(dates[lo:hi], self._values()[lo:hi])
+        return data[columns] if columns else data
+
+    def append(self, data: pd.DataFrame) -> int:
+        """Store rows of ``data`` (``Date`` column or index; OHLCV columns),
+        replacing stored rows of the same date. Rows from the last stored date
+        on are appended in place, replacing the last stored row if included;
+        earlier rows are skipped when already stored unchanged, while rows
+        filling a gap or revising history rewrite the whole series, keeping
+        every stored row not replaced. Returns the number of rows written."""
+        if data.index.name is not None:
+            data = data.reset_index()
+        data = data.drop_duplicates("Date", keep="last").sort_values("Date")
+        dates = pd.to_datetime(data.Date).values.astype("datetime64[D]")
+        values = data.reindex(columns=COLUMNS).to_numpy(dtype="float64")
+
+        stored = self._dates()
+        if len(stored) and len(dates) and dates[0] < stored[-1]:
+            earlier = dates < stored[-1]
+            found = stored.searchsorted(dates[earlier])
+            unchanged = np.array_equal(stored[found], dates[earlier]) and np.array_equal(
+                self._values()[found], values[earlier], equal_nan=True
+            )
+            if not unchanged:
+                return self._rewrite(dates, values)
+            dates, values = dates[~earlier], values[~earlier]
+
+        start = len(stored)
+        if len(stored) and len(dates) and dates[0] == stored[-1]:
+            start -= 1
+        del stored  # release the memory map before truncating
+
+        self._dir.mkdir(parents=True, exist_ok=True)
+        sizes = ((self._values_path, 8 * len(COLUMNS)), (self._dates_path, 8))
+        for path, itemsize in sizes:
+            with open(path, "ab") as file:
+                file.truncate(start * itemsize)
+        self._write(self._dir, dates, values, mode="ab")
+        return len(dates)
+
+    @staticmethod
+    def _write(directory: Path, dates: np.ndarray, values: np.ndarray, mode: str) -> None:
+        with open(directory / "values.f8", mode) as file:
+            file.write(np.ascontiguousarray(values).tobytes())
+        with open(directory / "dates.i8", mode) as file:
+            file.write(dates.astype("int64").tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _rewrite(self, dates: np.ndarray, values: np.ndarray) -> int:
+        """Merge rows into the stored series, incoming rows replacing stored
+        rows of the same date, and write the result to a hidden directory
+        swapped in once complete, so the stored series survives a killed run."""
+        stored = self._dates()
+        keep = ~np.isin(stored, dates)
+        dates = np.concatenate([stored[keep], dates])
+        values = np.concatenate([self._values()[keep], values])
+        order = dates.argsort(kind="stable")
+        del stored
+
+        temporary = self._dir.with_name(f".{self._dir.name}.tmp")
+        for directory in (temporary, self._previous):
+            shutil.rmtree(directory, ignore_errors=True)
+        temporary.mkdir(parents=True)
+        self._write(temporary, dates[order], values[order], mode="wb")
+
+        os.replace(self._dir, self._previous)
+        os.replace(temporary, self._dir)
+        shutil.rmtree(self._previous)
+        return len(dates)
+
+
+class OHLCVStoreDataSet(AbstractDataSet):
+    """Local append-only store of daily OHLCV series, one directory of
+    memory-mapped arrays per symbol, which can replace the Parquet
+    ``etf_historical`` datasets.
+
+    Loads a ``{symbol: TimeSeries}`` dictionary; each ``TimeSeries`` is
+    callable like a ``ParquetPartitionedDataSet`` loader, including
+    ``columns`` and ``Date`` ``filters``, and additionally supports
+    ``slice(start, end)`` and ``latest()``, reading only the rows needed.
+    With ``concat`` the series are loaded as one ``DataFrame`` instead, with
+    the symbol in column ``key``; with ``lazy`` as well, the load returns the
+    reading function, taking ``partitions`` (symbols), ``columns`` and
+    ``filters``, as ``ParquetPartitionedDataSet`` does.
+
+    Saving a dictionary, or an iterable of ``(symbol, data[, meta])`` tuples,
+    appends only the new days of each ``DataFrame`` (``Date`` column or
+    index; ``Open``, ``High``, ``Low``, ``Close`` and ``Volume`` columns).
+    Like ``StreamingPartitionedDataSet``, each saved series is recorded in a
+    JSON-lines manifest, describing the series as stored, and items whose
+    data is ``None`` in a failures log; both read with ``ManifestDataSet``.
+
+    Example:
+    ::
+
+        >>> etf_historical:
+        >>>   type: investing.extras.datasets.timeseries_dataset.OHLCVStoreDataSet
+        >>>   path: data/01_raw/historic_ohlcv
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        path: str,
+        key: str = "symbol",
+        columns: List[str] = None,
+        concat: bool = False,
+        lazy: bool = False,
+        manifest: str = "_manifest.jsonl",
+        failures: str = "_failures.jsonl",
+    ):
+        """Creates a new instance of ``OHLCVStoreDataSet``.
+
+        Args:
+            path: Local directory holding one sub-directory per symbol.
+            key: Name of the column holding the symbol, with ``concat``.
+            columns: Columns to load, all when not set.
+            concat: Load all series as one ``DataFrame``.
+            lazy: With ``concat``, load the function reading it instead.
+            manifest: Name of the manifest file, relative to ``path``.
+            failures: Name of the failures log, relative to ``path``.
+        """
+        self._path = Path(path)
+        self._key = key
+        self._columns = columns
+        self._concat = concat
+        self._lazy = lazy
+        self._manifest = manifest
+        self._failures = failures
+        self._filesystem = LocalFileSystem()
+
+    def _series(self) -> Dict[str, TimeSeries]:
+        if not self._path.exists():
+            return {}
+        return {
+            directory.name: TimeSeries(directory)
+            for directory in sorted(self._path.iterdir())
+            if directory.is_dir() and not directory.name.startswith(".")
+        }
+
+    def _read_concat(
+        self, partitions: List[str] = None, columns: List[str] = None, filters: List[Tuple] = None
+    ) -> pd.DataFrame:
+        """The given series (all when not set) as one ``DataFrame``, with the symbol in column ``key``."""
+        series = self._series()
+        selected = series if partitions is None else {s: series[s] for s in partitions if s in series}
+        frames = [
+            loader(columns or self._columns, filters).assign(**{self._key: symbol})
+            for symbol, loader in sorted(selected.items())
+        ]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def _load(self) -> Union[pd.DataFrame, Callable, Dict[str, Callable[[], Any]]]:
+        if self._concat:
+            return self._read_concat if self._lazy else self._read_concat()
+
+        return {
+            symbol: partial(loader, columns=self._columns) if self._columns else loader
+            for symbol, loader in self._series().items()
+        }
+
+    def _save(self, data: Union[Dict[str, pd.DataFrame], Iterable[Tuple]]) -> None:
+        manifest_path = str(self._path / self._manifest)
+        failures_path = str(self._path / self._failures)
+        items = sorted(data.items()) if isinstance(data, dict) else data
+        failed = _read_manifest(self._filesystem, failures_path)
+        self._path.mkdir(parents=True, exist_ok=True)
+
+        saved = False
+        try:
+            for symbol, series, *meta in items:
+                meta = meta[0] if meta else {}
+                count = failed.get(symbol, {}).get("failures", 0)
+                today = pd.Timestamp.today().strftime("%Y-%m-%d")
+                if series is None:
+                    entry = {"partition": symbol, "saved": today, "failures": count + 1, **meta}
+                    _append_jsonl(self._filesystem, failures_path, entry)
+                    failed[symbol] = {"failures": count + 1}
+                    continue
+
+                stored = TimeSeries(self._path / symbol)
+                stored.append(series)
+                entry = {
+                    "partition": symbol,
+                    "saved": today,
+                    "path": str(self._path / symbol),
+                    **_partition_stats(stored(), "Date"),
+                    **meta,
+                }
+                _append_jsonl(self._filesystem, manifest_path, entry)
+                if count:
+                    entry = {"partition": symbol, "saved": today, "failures": 0}
+                    _append_jsonl(self._filesystem, failures_path, entry)
+                    failed[symbol] = {"failures": 0}
+                saved = True
+        finally:
+            if saved:
+                _compact_jsonl(self._filesystem, manifest_path)
+                _compact_jsonl(self._filesystem, failures_path)
+
+    def _exists(self) -> bool:
+        return self._path.exists()
+
+    def _describe(self) -> Dict[str, Any]:
+        return dict(
+            path=self._path,
+            key=self._key,
+            columns=self._columns,
+            concat=self._concat,
+            lazy=self._lazy,
+            manifest=self._manifest,
+            failures=self._failures,
+        )
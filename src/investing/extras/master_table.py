@@ -0,0 +1,157 @@
+"""Indexed, many-to-one joins of lookup tables onto a base table."""
+import logging
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.errors import MergeError
+
+log = logging.getLogger(__name__)
+
+
+def _combine(codes: List[np.ndarray]) -> np.ndarray:
+    """Single dense integer id per combination of key ids; -1 where any key is missing."""
+    combined = codes[0]
+    for code in codes[1:]:
+        valid = (combined >= 0) & (code >= 0)
+        pair = combined * (code.max() + 1 if len(code) else 1) + code
+        combined = np.full(len(code), -1, dtype="int64")
+        combined[valid] = pd.factorize(pair[valid])[0]
+    return combined
+
+
+def _take(codes: np.ndarray, positions: np.ndarray, missing: int = -1) -> np.ndarray:
+    """Codes at row positions; ``missing`` where the position is -1 (no row)."""
+    if not len(codes):
+        return np.full(len(positions), missing, dtype="int64")
+    return np.where(positions >= 0, codes.take(positions, mode="clip"), missing)
+
+
+class MasterTable:
+    """Builds a wide table by left or inner joining lookup tables onto a base
+    table, like a chain of ``pandas.merge`` calls with ``validate="many_to_one"``,
+    without copying the accumulated table at every join.
+
+    Joins are only recorded until ``build``. Then the values of every key
+    column involved are encoded once, as integer ids shared by all tables.
+    Each join becomes an integer index lookup of row positions, and the joined
+    columns are gathered once at the end. Joined tables must be unique on
+    their join keys: a duplicated key raises ``pandas.errors.MergeError``, as
+    ``validate="many_to_one"`` does, unless the join is recorded with
+    ``take_first=True``, which joins the first row of each key with a warning.
+    As in ``pandas.merge``, missing key values (``NaN``, ``None``) match each
+    other.
+
+    Example:
+    ::
+
+        >>> master = (
+        >>>     MasterTable(etfs)
+        >>>     .join(etf_information, left_on=["name"], right_on=["ETF Name"])
+        >>>     .join(current_holdings, on=["symbol_ft", "stock_exchange"])
+        >>>     .build()
+        >>> )
+    """
+
+    def __init__(self, base: pd.DataFrame):
+        self._tables = [base.reset_index(drop=True)]
+        self._joins = []
+
+    def join(  # pylint: disable=too-many-arguments
+        self,
+        table: pd.DataFrame,
+        on: Sequence[str] = None,
+        left_on: Sequence[str] = None,
+        right_on: Sequence[str] = None,
+        how: str = "left",
+        suffixes: Tuple[str, str] = ("_x", "_y"),
+        take_first: bool = False,
+    ) -> "MasterTable":
+        """Record a join of ``table`` onto the table built so far; arguments
+        as ``pandas.merge``, with ``how`` either ``left`` or ``inner``. With
+        ``take_first``, only the first row of each duplicated key is joined,
+        rather than raising ``pandas.errors.MergeError``."""
+        if how not in ("left", "inner"):
+            raise ValueError(f"Unsupported join type `{how}`, use `left` or `inner`")
+        left_on, right_on = list(left_on or on), list(right_on or on)
+        if len(left_on) != len(right_on):
+            raise ValueError("`left_on` and `right_on` must have the same length")
+
+        self._tables.append(table.reset_index(drop=True))
+        self._joins.append((len(self._tables) - 1, left_on, right_on, how, suffixes, take_first))
+        return self
+
+    def _layout(self) -> Tuple[Dict[str, Tuple[int, str]], List[List[Tuple[int, str]]]]:
+        """Output column names, mapped to their (table, column), and the
+        left key columns of each join; renamed by suffixes as pandas does."""
+        layout = {column: (0, column) for column in self._tables[0].columns}
+        left_keys = []
+        for table, left_on, right_on, _, suffixes, _ in self._joins:
+            left_keys.append([layout[column] for column in left_on])
+
+            same_name = {right for left, right in zip(left_on, right_on) if left == right}
+            for column in self._tables[table].columns:
+                if column in same_name:
+                    continue
+                name = column
+                if column in layout:
+                    layout = {
+                        (key + suffixes[0] if key == column else key): value
+                        for key, value in layout.items()
+                    }
+                    name = column + suffixes[1]
+                layout[name] = (table, column)
+        return layout, left_keys
+
+    def build(self) -> pd.DataFrame:
+        layout, left_keys = self._layout()
+
+        # encode every key column once, in one shared vocabulary; missing
+        # values share one code, so match each other as in ``pandas.merge``
+        key_columns = list(dict.fromkeys(
+            [source for keys in left_keys for source in keys]
+            + [(table, column) for table, _, right_on, *_ in self._joins for column in right_on]
+        ))
+        values = [self._tables[t][c].to_numpy(dtype=object) for t, c in key_columns]
+        sizes = np.cumsum([len(v) for v in values])[:-1]
+        values = np.concatenate(values) if values else np.array([], dtype=object)
+        codes, uniques = pd.factorize(values)
+        missing = len(uniques)
+        codes[pd.isna(values)] = missing
+        codes = dict(zip(key_columns, np.split(codes, sizes)))
+
+        positions = {0: np.arange(len(self._tables[0]))}
+        keep = np.ones(len(self._tables[0]), dtype=bool)
+        for (table, _, right_on, how, _, take_first), keys in zip(self._joins, left_keys):
+            # rows left unjoined by an earlier join have missing values in its columns
+            left = [_take(codes[source], positions[source[0]], missing) for source in keys]
+            right = [codes[(table, column)] for column in right_on]
+            combined = _combine([np.concatenate(pair) for pair in zip(left, right)])
+            left_ids, right_ids = combined[:len(left[0])], combined[len(left[0]):]
+
+            index = pd.Index(right_ids)
+            duplicated = index.duplicated()
+            if duplicated.any():
+                examples = self._tables[table][duplicated][right_on].drop_duplicates().head()
+                if not take_first:
+                    raise MergeError(
+                        f"Join keys {right_on} are not unique in the joined table; not a many-to-one "
+                        f"join ({duplicated.sum()} duplicated rows), e.g.\n{examples}"
+                    )
+                log.warning(
+                    f"Join keys {right_on} are not unique in the joined table, joining the first of "
+                    f"{duplicated.sum()} duplicated rows, e.g.\n{examples}"
+                )
+            rows = np.flatnonzero(~duplicated)
+            found = pd.Index(right_ids[rows]).get_indexer(left_ids)
+            positions[table] = _take(rows, found)
+            if how == "inner":
+                keep &= positions[table] >= 0
+
+        rows = np.flatnonzero(keep)
+        columns = {}
+        for name, (table, column) in layout.items():
+            series = self._tables[table][column]
+            series = series.take(rows) if table == 0 else series.reindex(positions[table][rows])
+            columns[name] = series.reset_index(drop=True)
+        return pd.DataFrame(columns, index=pd.RangeIndex(len(rows)))
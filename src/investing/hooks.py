@@ -36,6 +36,7 @@ from kedro.io import DataCatalog
 from kedro.pipeline import Pipeline
 from kedro.versioning import Journal
 
+from investing.pipelines.backtest import pipeline as backtest
 from investing.pipelines.data_extraction import pipeline as data_extraction
 from investing.pipelines.prophet_model import pipeline as prophet_model
 from investing.pipelines.reporting import pipeline as reporting
@@ -53,12 +54,18 @@ class ProjectHooks:
         """
         data_extraction_pipeline = data_extraction.create_pipeline()
         prophet_model_pipeline = prophet_model.create_pipeline()
+        prophet_predict_pipeline = prophet_model.create_predict_pipeline()
+        prophet_evaluation_pipeline = prophet_model.create_evaluation_pipeline()
         reporting_pipeline = reporting.create_pipeline()
+        backtest_pipeline = backtest.create_pipeline()
 
         return {
             "data_extraction": data_extraction_pipeline,
             "prophet_model": prophet_model_pipeline,
+            "prophet_predict": prophet_predict_pipeline,
+            "prophet_evaluation": prophet_evaluation_pipeline,
             "reporting": reporting_pipeline,
+            "backtest": backtest_pipeline,
             "__default__": data_extraction_pipeline + prophet_model_pipeline + reporting_pipeline
             }
 
@@ -0,0 +1,172 @@
+import logging
+from itertools import product
+from statistics import NormalDist
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+
+RESULT_COLUMNS = [
+    'min_age', 'volatility_factor', 'total_return', 'cagr', 'annual_volatility', 'max_drawdown',
+    'annual_turnover', 'avg_positions', 'trades', 'hit_rate',
+]
+
+
+def _rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+    '''Sum of the last `window` rows up to and including each row, for every column'''
+    cumulative = np.vstack([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+    end = np.arange(1, len(values) + 1)
+    return cumulative[end] - cumulative[np.maximum(end - window, 0)]
+
+
+def _rolling_bands(close: np.ndarray, backtest_params: Dict) -> Dict[str, np.ndarray]:
+    '''Out-of-sample forecast bands for every date and ETF: a log-linear trend and residual band fitted on the
+    previous `band_window` prices, as the band model backend, extrapolated one row ahead'''
+
+    window = backtest_params['band_window']
+    y = np.log(close)
+    mask = np.isfinite(y)
+    t = np.broadcast_to(np.arange(len(y), dtype='float64')[:, None], y.shape)
+    y, t0 = np.where(mask, y, 0), np.where(mask, t, 0)
+
+    n = _rolling_sum(mask.astype('float64'), window)
+    s_t, s_tt = _rolling_sum(t0, window), _rolling_sum(t0 ** 2, window)
+    s_y, s_ty, s_yy = _rolling_sum(y, window), _rolling_sum(t0 * y, window), _rolling_sum(y ** 2, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * s_ty - s_t * s_y) / (n * s_tt - s_t ** 2)
+        intercept = (s_y - slope * s_t) / n
+        sse = (s_yy - 2 * intercept * s_y - 2 * slope * s_ty
+               + n * intercept ** 2 + 2 * intercept * slope * s_t + slope ** 2 * s_tt)
+        sigma = np.sqrt(np.clip(sse, 0, None) / (n - 2))
+    fitted = n >= backtest_params['min_rows']
+
+    # bands for each row come from the fit up to the previous row
+    z = NormalDist().inv_cdf((1 + backtest_params['interval_width']) / 2)
+    trend = np.full(y.shape, np.nan)
+    spread = np.full(y.shape, np.nan)
+    trend[1:] = np.where(fitted, intercept + slope * (t + 1), np.nan)[:-1]
+    spread[1:] = np.where(fitted, z * sigma, np.nan)[:-1]
+
+    return {'yhat_lower': np.exp(trend - spread), 'yhat_upper': np.exp(trend + spread)}
+
+
+def build_backtest_panel(historical: pd.DataFrame, backtest_params: Dict) -> Dict[str, pd.DataFrame]:
+    '''Aligned date x ETF panel of prices, forecast bands, age and volatility, from all historical prices at once'''
+
+    historical = historical.assign(Date=pd.to_datetime(historical.Date))
+    close, low, high = (
+        historical.pivot_table(index='Date', columns='symbol', values=column, aggfunc='last')
+        for column in ('Close', 'Low', 'High')
+    )
+    low, high = low.reindex_like(close), high.reindex_like(close)
+
+    bands = _rolling_bands(close.to_numpy(dtype='float64'), backtest_params)
+
+    first = pd.to_datetime(close.apply(pd.Series.first_valid_index))
+    age = (close.index.values[:, None] - first.values[None, :]) / np.timedelta64(1, 'D') / 365
+
+    # median yearly range of the previous volatility_years complete years, as the historical meta volatility
+    yearly = close.groupby(close.index.year)
+    yearly_range = (yearly.max() - yearly.min()) / yearly.min()
+    volatility = (
+        yearly_range.rolling(backtest_params['volatility_years'], min_periods=1).median().shift(1)
+        .reindex(close.index.year)
+    )
+
+    panel = {
+        'close': close,
+        'day_low': low,
+        'day_high': high,
+        'age': pd.DataFrame(age, index=close.index, columns=close.columns),
+        'volatility': pd.DataFrame(volatility.to_numpy(), index=close.index, columns=close.columns),
+        **{name: pd.DataFrame(band, index=close.index, columns=close.columns) for name, band in bands.items()},
+    }
+    start = pd.Timestamp(backtest_params['start_date'])
+    log.info(f"Backtest panel of {close.shape[1]} ETFs over {(close.index >= start).sum()} dates from {start:%Y-%m-%d}")
+
+    return {name: frame[frame.index >= start] for name, frame in panel.items()}
+
+
+def _simulate(panel: Dict[str, np.ndarray], dates: pd.DatetimeIndex, dividends: np.ndarray, min_age: float,
+              volatility_factor: float, max_positions: int) -> Dict[str, float]:
+    '''Replay the buy/sell rules with one parameter set over the whole panel (rows dated by dates)'''
+
+    close = panel['close']
+    buy = (panel['day_low'] < panel['yhat_lower']) & (panel['age'] > min_age)
+    sell = panel['day_high'] > panel['yhat_upper']
+
+    # prices carried forward over days an ETF has none, so a position and its move over the gap are kept
+    filled = pd.DataFrame(close).ffill().to_numpy()
+
+    # hold from a buy flag until the next sell flag (sell wins on the same day), once prices exist
+    state = pd.DataFrame(np.where(sell, 0.0, np.where(buy, 1.0, np.nan))).ffill().fillna(0).to_numpy()
+    held = (state > 0) & np.isfinite(filled)
+
+    # keep the max_positions held ETFs with the best expected return, equally weighted
+    expected = np.where(held, volatility_factor * np.nan_to_num(panel['volatility']) + dividends, -np.inf)
+    rank = (-expected).argsort(axis=1).argsort(axis=1)
+    held &= rank < max_positions
+    count = held.sum(axis=1, keepdims=True)
+    weights = np.divide(held, count, out=np.zeros(held.shape), where=count > 0)
+
+    # flags use the day's prices, so positions are taken at the close and earn from the next day
+    weights = np.vstack([np.zeros((1, weights.shape[1])), weights[:-1]])
+    returns = np.nan_to_num(filled / np.vstack([np.full((1, close.shape[1]), np.nan), filled[:-1]]) - 1)
+
+    daily = (weights * returns).sum(axis=1)
+    equity = np.cumprod(1 + daily)
+    years = (dates[-1] - dates[0]).days / 365.25 if len(dates) else 0
+    turnover = 0.5 * np.abs(np.diff(weights, axis=0, prepend=0)).sum(axis=1)
+
+    # trades: consecutive days an ETF is held; a hit when its return over the trade is positive
+    invested = weights > 0
+    entries = invested & ~np.vstack([np.zeros((1, invested.shape[1]), dtype=bool), invested[:-1]])
+    trade = np.cumsum(entries, axis=0)[invested] * invested.shape[1] + np.nonzero(invested)[1]
+    trade_returns = np.bincount(pd.factorize(trade)[0], weights=np.log1p(returns[invested]))
+
+    return {
+        'total_return': equity[-1] - 1 if len(equity) else 0.0,
+        'cagr': equity[-1] ** (1 / years) - 1 if years else np.nan,
+        'annual_volatility': daily.std() * 252 ** 0.5,
+        'max_drawdown': (equity / np.maximum.accumulate(equity) - 1).min() if len(equity) else 0.0,
+        'annual_turnover': turnover.sum() / years if years else np.nan,
+        'avg_positions': count.mean(),
+        'trades': len(trade_returns),
+        'hit_rate': (trade_returns > 0).mean() if len(trade_returns) else np.nan,
+    }
+
+
+def backtest_buy_sell(panel: Dict[str, pd.DataFrame], etf_information: pd.DataFrame, backtest_params: Dict) -> pd.DataFrame:
+    '''Returns, turnover and hit-rate of the buy/sell rules for every parameter set of the grid'''
+
+    etfs = panel['close'].columns
+    dividends = (
+        pd.to_numeric(etf_information.set_index('name')['Dividend Yield'].str.strip('%'), errors='coerce').div(100)
+        .reindex(etfs).fillna(0).to_numpy()
+    )
+    arrays = {name: frame.to_numpy(dtype='float64') for name, frame in panel.items()}
+    dates = panel['close'].index
+
+    grid = backtest_params['grid']
+    parameter_sets = list(product(grid['min_age'], grid['volatility_factor']))
+    if not len(dates) or not parameter_sets:
+        log.warning("Nothing to backtest: no prices from the start date, or an empty parameter grid")
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    rows = []
+    for min_age, volatility_factor in parameter_sets:
+        results = _simulate(arrays, dates, dividends, min_age, volatility_factor, backtest_params['max_positions'])
+        rows.append({'min_age': min_age, 'volatility_factor': volatility_factor, **results})
+
+    results = pd.DataFrame(rows, columns=RESULT_COLUMNS).sort_values('cagr', ascending=False, ignore_index=True)
+    best = results.iloc[0]
+    log.info(
+        f"Backtested {len(results)} parameter sets; best min_age {best.min_age}, volatility_factor "
+        f"{best.volatility_factor}: CAGR {best.cagr:.1%}, hit rate {best.hit_rate:.0%}"
+    )
+
+    return results
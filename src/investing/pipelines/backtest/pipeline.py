@@ -0,0 +1,24 @@
+from kedro.pipeline import node, Pipeline
+
+from .nodes import (
+    build_backtest_panel,
+    backtest_buy_sell,
+)
+
+def create_pipeline(**kwargs) -> Pipeline:
+    return Pipeline(
+        [
+            node(
+                func=build_backtest_panel,
+                inputs=['etf_historical_panel', 'params:backtest_params'],
+                outputs='etf_backtest_panel',
+                name='etf_backtest_panel'
+            ),
+            node(
+                func=backtest_buy_sell,
+                inputs=['etf_backtest_panel', 'etf_information', 'params:backtest_params'],
+                outputs='etf_backtest',
+                name='etf_backtest'
+            ),
+        ]
+    )
@@ -0,0 +1,96 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    '''Thread-safe token bucket, allowing `rate` requests per second on average and bursts of up to `capacity`'''
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        '''Block the calling thread until a token is available, then consume it'''
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Downloader:
+    '''Concurrent download engine: bounded thread pool, shared token-bucket rate limit and jittered exponential backoff'''
+
+    def __init__(self, download_params: Dict, label: str):
+        self.label = label
+        self.max_workers = download_params['max_workers']
+        self.max_retries = download_params['max_retries']
+        self.backoff_base = download_params['backoff_base']
+        self.backoff_max = download_params['backoff_max']
+        self.bucket = TokenBucket(download_params['rate_per_second'], download_params['burst'])
+
+    def _backoff(self, attempt: int) -> float:
+        '''"Full jitter" exponential backoff delay in seconds, so that retries from different threads spread out'''
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, func: Callable, *args, **kwargs) -> Any:
+        '''Call func once a rate limit token is available, retrying failures with backoff.
+
+        Backoff only sleeps the calling worker thread, other in-flight requests carry on.
+        '''
+
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                log.debug(f"Download retry {attempt + 1} in {delay:.1f}s ({self.label}): {e}")
+                time.sleep(delay)
+
+    def map(self, tasks: Dict[str, Callable[[], Any]]) -> Iterator[Tuple[str, Any]]:
+        '''Run tasks on the thread pool, yielding (name, result) as each completes.
+
+        At most twice max_workers tasks are in flight, so results waiting to be consumed stay bounded.
+        Tasks returning None (nothing to download) are skipped, and failed tasks are logged and skipped.
+        '''
+
+        queued = iter(tasks.items())
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while True:
+                for name, task in islice(queued, 2 * self.max_workers - len(pending)):
+                    pending[pool.submit(task)] = name
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception:
+                        log.warning(f"Download FAILED ({self.label}): {name}")
+                        continue
+                    if result is not None:
+                        log.debug(f"Download complete ({self.label}): {name}")
+                        yield name, result
@@ -1,23 +1,33 @@
 
 import logging
-from time import sleep
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, Optional, Set, Tuple, Union
 import warnings
 
 import investpy
 import pandas as pd
 
+from investing.extras.master_table import MasterTable
+
+from .download import Downloader
+
 log = logging.getLogger(__name__)
 
 
-def get_stock_lists():
-    '''Retrieve stock lists as dataframe tables, from investpy library'''
+def get_stock_lists(refresh: bool) -> Tuple:
+    '''Retrieve stock lists as dataframe tables, from investpy library.
+
+    The download functions are returned unevaluated, so the cached catalog datasets only call them once
+    their cache has expired; refresh downloads the lists now, overwriting the cache.
+    '''
+
+    downloads = investpy.get_stocks, investpy.get_etfs, investpy.get_indices
 
-    stocks = investpy.get_stocks()
-    etfs = investpy.get_etfs()
-    indices = investpy.get_indices()
+    if refresh:
+        return tuple(download() for download in downloads)
 
-    return stocks, etfs, indices
+    return downloads
 
 
 def cleanse_freetrade(ft: pd.DataFrame, mic_remap: Dict) -> pd.DataFrame:
@@ -32,82 +42,161 @@ def cleanse_freetrade(ft: pd.DataFrame, mic_remap: Dict) -> pd.DataFrame:
 
 
 def join_freetrade_etfs(ft: pd.DataFrame, etfs: pd.DataFrame) -> pd.DataFrame:
-    '''Inner join Freetrade stocks with stock list, to extract only relevant etfs (Joining key: ISIN)'''
+    '''Inner join Freetrade stocks with stock list, to extract only relevant etfs (Joining key: ISIN);
+    etfs listed more than once on the joining keys raise a MergeError'''
 
-    return pd.merge(ft, etfs, on=['isin', 'currency', 'stock_exchange'], how='inner', suffixes=('_ft', ''))
+    return (
+        MasterTable(ft)
+        .join(etfs, on=['isin', 'currency', 'stock_exchange'], how='inner', suffixes=('_ft', ''))
+        .build()
+    )
 
 
-def download_etfs_historical(etfs: pd.DataFrame, from_date: str) -> Dict:
-    '''Download all etf historical data'''
+def _merge_historical(stored: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    '''Append newly downloaded rows to stored history (Date index); latest download wins on overlapping dates'''
 
-    today = pd.to_datetime('today').strftime("%d/%m/%Y")
+    stored = stored.set_index(pd.to_datetime(stored.Date)).drop(columns='Date')
+    combined = pd.concat([stored, new])
+    combined = combined[~combined.index.duplicated(keep='last')].sort_index()
+    combined.index.name = 'Date'
 
-    parts = {}
-    
-    warnings.filterwarnings('ignore')
+    return combined
 
-    for i, row in etfs.iterrows():
 
-        file_name = f"etf_{row.symbol_ft}_{row['isin']}"
+def _up_to_date(entry: Dict, today: pd.Timestamp) -> bool:
+    '''Whether a stored history, as described by its manifest entry, already holds every complete trading day:
+    its last day was saved on a later day (so was final when saved) and no weekday has passed since'''
+
+    if 'max_date' not in entry:
+        return False
+    last_date = pd.Timestamp(entry['max_date'])
+    return entry['saved'] > entry['max_date'] and not len(pd.bdate_range(last_date + pd.Timedelta(days=1), today))
+
+
+def _download_historical(
+    downloader: Downloader, row: pd.Series, stored: Optional[Callable], entry: Dict, from_date: str, today: pd.Timestamp
+    ) -> Optional[pd.DataFrame]:
+    '''Download one etf's history; when previously stored data is given only dates from the last stored date are requested.
 
-        sleep(1)
+    The last stored date comes from the stored history's manifest entry, so an up to date history is not read at all.
+    '''
 
+    history, last_date, start = None, None, from_date
+    if stored is not None:
+        if _up_to_date(entry, today):
+            return None
         try:
-            parts[file_name] = investpy.get_etf_historical_data(
-                row['name'], row.country, 
-                stock_exchange=row.stock_exchange, 
-                from_date=from_date, to_date=today, 
-                as_json=False, order='ascending'
-            )
+            history = stored()
+            last_date = pd.to_datetime(entry.get('max_date') or history.Date.max())
+        except Exception as e:
+            # e.g. a partition truncated by a killed run: replaced by a full download
+            log.warning(f"{row['name']}: stored history unreadable ({type(e).__name__}: {e}), downloading in full")
+            history, last_date = None, None
+
+    if pd.notna(last_date):
+        # re-request the last stored day, which may have been saved part way through its trading day,
+        # from the day before at the latest, as investpy needs the range to span at least a day
+        start = min(last_date, today - pd.Timedelta(days=1)).strftime("%d/%m/%Y")
+
+    data = downloader.request(
+        investpy.get_etf_historical_data,
+        row['name'], row.country, 
+        stock_exchange=row.stock_exchange, 
+        from_date=start, to_date=today.strftime("%d/%m/%Y"), 
+        as_json=False, order='ascending'
+    )
 
-            log.debug(f"Download complete (ETF historical): {file_name}")
+    return data if history is None else _merge_historical(history, data)
 
-        except:
-            log.warning(f"Download FAILED (ETF historical): {file_name}")
-            sleep(30)
 
-    warnings.filterwarnings('default')
+def _saved_within(manifest: Dict[str, Dict], days: int) -> Set[str]:
+    '''Partitions saved within the last number of days (0: today only), according to the dataset manifest'''
+    since = (pd.to_datetime('today') - pd.Timedelta(days=days)).strftime("%Y-%m-%d")
+    return {name for name, entry in manifest.items() if entry['saved'] >= since}
 
-    log.info(f"{len(parts)} downloaded")
-    
-    return parts
 
+def _stream_downloads(parts: Iterator[Tuple[str, Any]], label: str) -> Iterator[Tuple[str, Any]]:
+    '''Pass downloaded partitions through as they complete, silencing investpy warnings and counting downloads'''
 
+    warnings.filterwarnings('ignore')
 
-def download_etf_information(etfs: pd.DataFrame) -> Dict:
-    '''Get latest etf information: latest price range, market cap etc.'''
+    count = 0
+    try:
+        for part in parts:
+            count += 1
+            yield part
+    finally:
+        warnings.filterwarnings('default')
+        log.info(f"{count} downloaded ({label})")
 
-    info = {}
 
-    for i, row in etfs.iterrows():
+def download_etfs_historical(
+    etfs: pd.DataFrame, from_date: str, stored: Dict[str, Any], manifest: Dict[str, Dict], download_params: Dict
+    ) -> Union[Dict, Iterator]:
+    '''Download all etf historical data; in incremental mode only dates from the last stored date are requested.
+
+    In stream mode partitions are returned as a generator, so each is saved as soon as it is downloaded,
+    and in resume mode partitions already saved today are skipped.
+    '''
 
+    today = pd.to_datetime('today').normalize()
+    incremental = download_params['incremental']
+    skip = _saved_within(manifest, 0) if download_params['resume'] else set()
+    downloader = Downloader(download_params, 'ETF historical')
+
+    tasks = {}
+    for i, row in etfs.iterrows():
         file_name = f"etf_{row.symbol_ft}_{row['isin']}"
+        if file_name in skip:
+            continue
+        previous = stored.get(file_name) if incremental else None
+        entry = manifest.get(file_name, {})
+        tasks[file_name] = partial(_download_historical, downloader, row, previous, entry, from_date, today)
 
-        sleep(1)
+    log.info(f"{len(skip)} already downloaded today, {len(tasks)} to download (ETF historical)")
+
+    parts = _stream_downloads(downloader.map(tasks), 'ETF historical')
+    
+    return parts if download_params['stream'] else dict(parts)
 
-        try:
-            info[file_name] = investpy.get_etf_information(row['name'], row.country, as_json=True)
-            log.debug(f"Download complete (ETF information): {file_name}")
 
-        except:
-            log.warning(f"Download FAILED (ETF information): {file_name}")
-            sleep(30)
 
-    warnings.filterwarnings('default')
+def download_etf_information(etfs: pd.DataFrame, manifest: Dict[str, Dict], download_params: Dict) -> Union[Dict, Iterator]:
+    '''Get latest etf information: latest price range, market cap etc.
 
-    log.info(f"{len(info)} downloaded")
+    Information saved within the last information_refresh_days is not downloaded again (0: every run),
+    as dividend yield and the like change slowly and the day range can be taken from historical data.
+    '''
+
+    refresh_days = download_params['information_refresh_days']
+    skip = _saved_within(manifest, refresh_days) if download_params['resume'] or refresh_days else set()
+    downloader = Downloader(download_params, 'ETF information')
+
+    tasks = {}
+    for i, row in etfs.iterrows():
+        file_name = f"etf_{row.symbol_ft}_{row['isin']}"
+        if file_name in skip:
+            continue
+        tasks[file_name] = partial(downloader.request, investpy.get_etf_information, row['name'], row.country, as_json=True)
+
+    log.info(f"{len(skip)} recently downloaded, {len(tasks)} to download (ETF information)")
+
+    info = _stream_downloads(downloader.map(tasks), 'ETF information')
     
-    return info
+    return info if download_params['stream'] else dict(info)
 
 
-def combine_etf_information(data: Dict) -> pd.DataFrame:
-    '''Combine stock information into one table, from folder of raw JSON files'''
+def combine_etf_information(data: Dict, information_params: Dict) -> pd.DataFrame:
+    '''Combine stock information into one table, from folder of raw JSON files (read concurrently)'''
 
-    lst = []
-    for name, info in data.items():
+    def _load(item):
+        name, info = item
         json = info()
         json['name'] = name
-        lst.append(json)
+        return json
+
+    with ThreadPoolExecutor(max_workers=information_params['load_workers']) as pool:
+        lst = list(pool.map(_load, data.items()))
 
     return pd.DataFrame.from_records(lst)
 
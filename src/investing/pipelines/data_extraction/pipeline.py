@@ -16,7 +16,7 @@ def create_pipeline(**kwargs) -> Pipeline:
         [
             node(
                 func=get_stock_lists,
-                inputs=None,
+                inputs='params:refresh_universe',
                 outputs=['investpy_stocks', 'investpy_etfs', 'investpy_indices'],
                 name='investpy_stock_lists'
             ),
@@ -39,7 +39,7 @@ def create_pipeline(**kwargs) -> Pipeline:
             ),
             node(
                 func=combine_etf_information,
-                inputs='etf_information_raw',
+                inputs=['etf_information_raw', 'params:information_params'],
                 outputs='etf_information',
                 name='combine_etfs_information'
             ),
@@ -50,13 +50,13 @@ def create_pipeline(**kwargs) -> Pipeline:
             ),
             node(
                 func=download_etfs_historical,
-                inputs=['etfs', 'params:from_date'],
+                inputs=['etfs', 'params:from_date', 'etf_historical_stored', 'etf_historical_manifest', 'params:download_params'],
                 outputs='etf_historical',
                 name='download_etfs_historical'
             ),
             node(
                 func=download_etf_information,
-                inputs='etfs',
+                inputs=['etfs', 'etf_information_manifest', 'params:download_params'],
                 outputs='etf_information_raw',
                 name='download_etfs_informaton'
             ),
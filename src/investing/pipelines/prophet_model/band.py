@@ -0,0 +1,119 @@
+import json
+import logging
+from statistics import NormalDist
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+log = logging.getLogger(__name__)
+
+YEAR = 365.25
+
+
+def _price_matrix(datasets: Dict[str, Any], start: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    '''Close prices of every series from start (all when not set), aligned on the union of their dates
+    (one column per series); only those rows and columns are read'''
+    filters = [('Date', '>=', start)] if start is not None else None
+    closes = {
+        name: data(columns=['Date', 'Close'], filters=filters).set_index('Date').Close
+        for name, data in datasets.items()
+    }
+    matrix = pd.concat(closes, axis=1)
+    matrix.index = pd.to_datetime(matrix.index)
+    return matrix.sort_index()
+
+
+def fit_band_models(
+    datasets: Dict[str, Any], data_manifest: Dict[str, Dict], band_params: Dict
+    ) -> Iterator[Tuple[str, str, Dict]]:
+    '''Fit a log-linear trend with a normal residual band to the last `window` dates of every series at once.
+
+    Only prices within twice `window` calendar days of the latest manifest date are read, which holds the
+    last `window` dates of the union of daily series with room to spare.
+
+    Each model is a small JSON document: trend intercept and slope (log price per year, relative to the
+    latest date of the matrix), residual standard deviation and the dates it was fitted on.
+    '''
+
+    dates = [entry['max_date'] for name, entry in data_manifest.items() if name in datasets and 'max_date' in entry]
+    start = pd.Timestamp(max(dates)) - pd.Timedelta(days=2 * band_params['window']) if dates else None
+
+    matrix = _price_matrix(datasets, start) if datasets else pd.DataFrame()
+    if matrix.empty:  # e.g. first run, or nothing listed
+        log.info("0 band models fitted, no prices to fit")
+        return
+    window = matrix.iloc[-band_params['window']:]
+    origin = window.index[-1]
+
+    y = np.log(window.to_numpy(dtype='float64'))
+    t = ((window.index - origin).days / YEAR).to_numpy()[:, None]
+    mask = np.isfinite(y)
+    n = mask.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_mean = np.where(mask, t, 0).sum(axis=0) / n
+        y_mean = np.where(mask, y, 0).sum(axis=0) / n
+        dt = np.where(mask, t - t_mean, 0)
+        dy = np.where(mask, y - y_mean, 0)
+        slope = (dt * dy).sum(axis=0) / (dt ** 2).sum(axis=0)
+        intercept = y_mean - slope * t_mean
+        residual = np.where(mask, y - (intercept + slope * t), 0)
+        sigma = np.sqrt((residual ** 2).sum(axis=0) / (n - 2))
+
+    first = window.apply(pd.Series.first_valid_index)
+    last = window.apply(pd.Series.last_valid_index)
+
+    fitted = 0
+    for i, name in enumerate(window.columns):
+        if n[i] < band_params['min_rows'] or not np.isfinite([slope[i], sigma[i]]).all():
+            log.warning(f"{name} has too few recent prices for a band model ({n[i]})")
+            continue
+        model = {
+            'backend': 'band',
+            'origin': origin.strftime('%Y-%m-%d'),
+            'start_date': first[name].strftime('%Y-%m-%d'),
+            'last_date': last[name].strftime('%Y-%m-%d'),
+            'intercept': float(intercept[i]),
+            'slope': float(slope[i]),
+            'sigma': float(sigma[i]),
+            'interval_width': band_params['interval_width'],
+        }
+        fitted += 1
+        yield name, json.dumps(model), {'backend': 'band', 'input_rows': int(n[i])}
+
+    log.info(f"{fitted} band models fitted on a {window.shape[0]} x {window.shape[1]} price matrix")
+
+
+def band_forecast(model: Dict, dates: pd.DatetimeIndex, columns: List[str]) -> pd.DataFrame:
+    '''Forecast of a band model at the given dates, in the Prophet forecast schema (ds index, yhat, yhat_lower, yhat_upper).
+
+    The band widens with the time beyond the last fitted date, relative to the length of the fitted window.
+    '''
+
+    origin, start, last = (pd.Timestamp(model[key]) for key in ('origin', 'start_date', 'last_date'))
+    t = ((dates - origin).days / YEAR).to_numpy()
+    span = max((last - start).days / YEAR, 1 / YEAR)
+    beyond = np.clip(((dates - last).days / YEAR).to_numpy(), 0, None)
+
+    z = NormalDist().inv_cdf((1 + model['interval_width']) / 2)
+    trend = model['intercept'] + model['slope'] * t
+    spread = z * model['sigma'] * np.sqrt(1 + beyond / span)
+
+    forecast = pd.DataFrame(
+        {'yhat': np.exp(trend), 'yhat_lower': np.exp(trend - spread), 'yhat_upper': np.exp(trend + spread)},
+        index=pd.Index(dates, name='ds'),
+    )
+    return forecast.reindex(columns=columns)
+
+
+def predict_band_model(model: Dict, prophet_params: Dict) -> pd.DataFrame:
+    '''Forecast over the same dates as a Prophet forecast: the last history_days of history and the future periods'''
+
+    last = pd.Timestamp(model['last_date'])
+    if prophet_params['history_days'] is not None:
+        start = last - pd.Timedelta(days=prophet_params['history_days'] - 1)
+    else:
+        start = pd.Timestamp(model['start_date'])
+    dates = pd.date_range(start, last + pd.Timedelta(days=prophet_params['periods']), freq='D')
+    return band_forecast(model, dates, prophet_params['columns'])
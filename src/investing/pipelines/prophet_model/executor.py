@@ -0,0 +1,111 @@
+import logging
+import multiprocessing
+import os
+import queue
+import time
+from collections import Counter
+from functools import partial
+from multiprocessing import Pool
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from .work_queue import imap_queue
+
+log = logging.getLogger(__name__)
+
+_started = None  # worker side: queue announcing which series a worker has started
+
+
+def _init_worker(started: multiprocessing.Queue):
+    global _started
+    _started = started
+
+
+def _run_isolated(func: Callable, item: Tuple) -> Tuple[str, Any, Optional[str]]:
+    '''Run func on one item (name first) in a worker, returning the error instead of raising it'''
+
+    name = item[0]
+    _started.put((name, time.time()))
+    try:
+        return name, func(item), None
+    except Exception as e:
+        return name, None, f"{type(e).__name__}: {e}"
+
+
+def imap_isolated(func: Callable, items: Dict[str, Tuple], executor_params: Dict) -> Iterator[Tuple[str, Any, Optional[str]]]:
+    '''Run func over items on a process pool, yielding (name, result, error) as each series completes.
+
+    Items are dispatched one at a time in the given order, so ordering them longest first balances the workers.
+
+    A failing series does not affect the others: it is retried up to `retries` times, then yielded with its error.
+    A series running longer than `timeout` seconds has its pool terminated and counts as failed; the other
+    series in flight are requeued. Workers are replaced after `maxtasksperchild` series to cap memory growth.
+    '''
+
+    workers = executor_params['workers'] or max(os.cpu_count() - 1, 1)
+    timeout = executor_params['timeout']
+
+    pending = dict(items)
+    attempts = Counter()
+
+    def _failed(name, error):
+        attempts[name] += 1
+        if attempts[name] > executor_params['retries']:
+            del pending[name]
+            return True
+        log.debug(f"Retrying {name} after failure: {error}")
+        return False
+
+    while pending:
+        started = multiprocessing.Queue()
+        pool = Pool(
+            workers, initializer=_init_worker, initargs=(started,),
+            maxtasksperchild=executor_params['maxtasksperchild']
+        )
+        results = pool.imap_unordered(partial(_run_isolated, func), list(pending.values()), chunksize=1)
+
+        remaining, running, done, overdue = len(pending), {}, set(), []
+        try:
+            while remaining and not overdue:
+                try:
+                    name, result, error = results.next(timeout=1)
+                except multiprocessing.TimeoutError:
+                    try:
+                        while True:
+                            name, start = started.get_nowait()
+                            if name not in done:
+                                running[name] = start
+                    except queue.Empty:
+                        pass
+                    overdue = [name for name, start in running.items() if time.time() - start > timeout]
+                    continue
+
+                remaining -= 1
+                done.add(name)
+                running.pop(name, None)
+
+                if error is None:
+                    del pending[name]
+                    yield name, result, None
+                elif _failed(name, error):
+                    yield name, None, error
+
+        finally:
+            if overdue or remaining:
+                pool.terminate()
+            else:
+                pool.close()
+            pool.join()
+
+        for name in overdue:
+            log.warning(f"{name} exceeded {timeout}s, terminating workers")
+            if _failed(name, f"TimeoutError: exceeded {timeout}s"):
+                yield name, None, f"TimeoutError: exceeded {timeout}s"
+
+
+def imap_tasks(func: Callable, items: Dict[str, Tuple], executor_params: Dict) -> Iterator[Tuple[str, Any, Optional[str]]]:
+    '''Run func over items with the configured executor mode: 'local' process pool, or 'queue' for the work queue
+    shared with `kedro worker` processes on any machine'''
+
+    if executor_params['mode'] == 'queue':
+        return imap_queue(func, items, executor_params)
+    return imap_isolated(func, items, executor_params)
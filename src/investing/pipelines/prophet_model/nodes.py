@@ -1,11 +1,23 @@
+import hashlib
+import json
 import logging
 import os
+import re
+import resource
+import socket
+import tempfile
+import time
 import warnings
-from multiprocessing import Pool
-from typing import Any, Dict, ItemsView
+from collections import Counter
+from typing import Any, Dict, ItemsView, Iterator, List, Optional, Set, Tuple
 
+import numpy as np
 import pandas as pd
 from fbprophet import Prophet
+from fbprophet.serialize import model_from_json, model_to_json
+
+from .band import band_forecast, fit_band_models, predict_band_model
+from .executor import imap_tasks
 
 log = logging.getLogger(__name__)
 
@@ -13,45 +25,430 @@ logging.getLogger('fbprophet').setLevel(logging.ERROR)  # ignore model convergan
 warnings.simplefilter("ignore", DeprecationWarning)     # ignore depracation warnings
 
 
-def _transform_model_input(data: pd.DataFrame) -> pd.DataFrame:
-    '''Prepare data prior to fitting to Prophet model'''
+def _model_config(prophet_params: Dict) -> Dict:
+    '''Parameters affecting the fitted model, as opposed to how it is computed or what is predicted'''
+    return {key: prophet_params[key] for key in ('backend', 'model', 'lookback_years', 'resample')}
+
+def _model_args(prophet_params: Dict) -> Dict:
+    '''Prophet constructor arguments; daily and weekly seasonality cannot be fitted on resampled data, so are disabled'''
+    args = {'daily_seasonality': False, 'weekly_seasonality': False} if prophet_params['resample'] else {}
+    return {**args, **prophet_params['model']}
+
+def _forecast_meta(model_hash: str, prophet_params: Dict) -> Dict:
+    '''Stored model and prediction parameters a forecast was made with; unchanged meta means unchanged forecast'''
+    forecast = {key: prophet_params[key] for key in ('periods', 'history_days', 'columns')}
+    return {'model_hash': model_hash, **forecast}
+
+def _input_hash(entry: Dict, prophet_params: Dict) -> Optional[str]:
+    '''Hash of the input series, from its content hash in the historical manifest, and model configuration;
+    unchanged hash means unchanged model. None when the manifest records no hash for the series'''
+    if 'hash' not in entry:
+        return None
+    config = json.dumps(_model_config(prophet_params), sort_keys=True)
+    return hashlib.sha1((entry['hash'] + config).encode()).hexdigest()
+
+def _transform_model_input(data: pd.DataFrame, prophet_params: Dict) -> pd.DataFrame:
+    '''Prepare data prior to fitting to Prophet model: keep the last lookback_years of history,
+    and the last price of each resample period (e.g. 'W' for weekly)'''
     data.rename(columns={'Close': 'y', 'Date': 'ds'}, inplace=True)
-    data.index = pd.to_datetime(data['ds'])
+    data['ds'] = pd.to_datetime(data['ds'])
+    if prophet_params['lookback_years'] is not None:
+        data = data[data.ds > data.ds.max() - pd.DateOffset(years=prophet_params['lookback_years'])]
+    if prophet_params['resample']:
+        data = data.sort_values('ds').groupby(pd.Grouper(key='ds', freq=prophet_params['resample'])).tail(1)
+    data.index = data['ds']
     return data
 
-def _fit_prophet_model(data: pd.DataFrame) -> pd.DataFrame:
-    '''Fit and make future prediction using Prophet model'''
-    model = Prophet()
-    with suppress_stdout_stderr():
+def _stan_init(model: Prophet) -> Dict:
+    '''Fitted parameters, in the form Prophet.fit accepts as initial values'''
+    init = {name: float(model.params[name][0][0]) for name in ['k', 'm', 'sigma_obs']}
+    init.update({name: model.params[name][0].tolist() for name in ['delta', 'beta']})
+    return init
+
+def _diverged(init: Dict) -> bool:
+    '''Fitted parameters are not usable: non-finite values or no observation noise left'''
+    values = np.concatenate([np.ravel(value) for value in init.values()])
+    return not np.isfinite(values).all() or init['sigma_obs'] <= 0
+
+def _fit_prophet_model(
+    data: pd.DataFrame, prophet_params: Dict, init: Optional[Dict] = None
+    ) -> Tuple[Prophet, float, bool, str]:
+    '''Fit Prophet model, warm-started from previously fitted parameters when given; cold start if that fails or diverges.
+    Also returns the Stan optimizer output'''
+
+    if init is not None:
+        start = time.perf_counter()
+        try:
+            model = Prophet(**_model_args(prophet_params))
+            with capture_stdout_stderr() as captured:
+                model.fit(data, init=init)
+            if not _diverged(_stan_init(model)):
+                return model, time.perf_counter() - start, True, captured.output
+        except Exception as e:
+            log.debug(f"Warm start failed, falling back to cold start: {e}")
+
+    start = time.perf_counter()
+    model = Prophet(**_model_args(prophet_params))
+    with capture_stdout_stderr() as captured:
         model.fit(data)
-    forecast = model.make_future_dataframe(periods=90, freq='D')
-    forecast = model.predict(forecast)
+    return model, time.perf_counter() - start, False, captured.output
+
+_ITERATION = re.compile(r'^\s*(\d+)\s+-?\d')  # Stan optimizer progress line, starting with the iteration number
+
+def _stan_stats(output: str) -> Dict:
+    '''Optimizer iterations and convergence status, parsed from Stan output'''
+    iterations = [int(match.group(1)) for match in map(_ITERATION.match, output.splitlines()) if match]
+    converged = 'terminated normally' in output if 'Optimization terminated' in output else None
+    return {'iterations': max(iterations, default=None), 'converged': converged}
+
+def _rss_mb() -> Optional[float]:
+    '''Current resident memory of this process in MiB, from /proc (Linux only)'''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return None
+
+def _reset_peak_rss() -> bool:
+    '''Reset the peak resident memory of this process to its current value (Linux 4.0+), so the peak read
+    after a fit is the fit's own rather than the worker's lifetime peak'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+def _peak_rss_mb() -> Optional[float]:
+    '''Peak resident memory of this process since it started or was last reset, in MiB (Linux only)'''
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10  # kB
+    except OSError:
+        pass
+    return None
+
+def _process_stats(rss_before: Optional[float], peak_reset: bool) -> Dict:
+    '''Resident memory of the fit just run: growth over rss_before, and its peak when the process peak was reset
+    before it (None where unavailable); and the worker id'''
+    rss = _rss_mb()
+    peak = _peak_rss_mb() if peak_reset else None
+    return {
+        'rss_delta_mb': round(rss - rss_before, 1) if rss is not None and rss_before is not None else None,
+        'peak_rss_mb': round(peak, 1) if peak is not None else None,
+        'worker': f"{socket.gethostname()}:{os.getpid()}",
+    }
+
+def _predict_prophet_model(model: Prophet, prophet_params: Dict) -> pd.DataFrame:
+    '''Make future prediction using fitted Prophet model, over the last history_days of history
+    (all when not set) and the future periods, keeping only the configured columns'''
+    future = model.make_future_dataframe(periods=prophet_params['periods'], freq='D')
+    if prophet_params['history_days'] is not None:
+        start = model.history_dates.max() - pd.Timedelta(days=prophet_params['history_days'])
+        future = future[future.ds > start]
+    forecast = model.predict(future)
     forecast.set_index('ds', inplace=True)
-    return forecast
+    return forecast[prophet_params['columns']]
+
+def _quarantined(failures: Dict[str, Dict], executor_params: Dict) -> Set[str]:
+    '''Series which failed in quarantine_after consecutive runs, the latest within quarantine_days'''
+    since = (pd.Timestamp.today() - pd.Timedelta(days=executor_params['quarantine_days'])).strftime('%Y-%m-%d')
+    return {
+        name for name, entry in failures.items()
+        if entry['failures'] >= executor_params['quarantine_after'] and entry['saved'] >= since
+    }
+
+def _fit_costs(names: List[str], manifest: Dict[str, Dict], data_manifest: Dict[str, Dict]) -> Dict[str, float]:
+    '''Estimated fit seconds per series: the previous fit time, else its row count at the average previous seconds per row'''
+
+    fitted = [entry for entry in manifest.values() if entry.get('input_rows') and 'fit_seconds' in entry]
+    per_row = sum(e['fit_seconds'] for e in fitted) / sum(e['input_rows'] for e in fitted) if fitted else 1.0
+
+    costs = {}
+    for name in names:
+        if 'fit_seconds' in manifest.get(name, {}):
+            costs[name] = manifest[name]['fit_seconds']
+        else:
+            costs[name] = data_manifest.get(name, {}).get('rows', 0) * per_row
+    return costs
+
+def _within_forecast(hist: pd.DataFrame, forecast: Optional[Any], previous: Dict, drift_params: Dict) -> bool:
+    '''Prices since the stored model was fitted are still explained by its forecast: the model is recent enough,
+    few prices fall outside the forecast interval and the mean error relative to yhat is small'''
+
+    if forecast is None or 'last_date' not in previous:
+        return False
+    if (pd.Timestamp.today() - pd.Timestamp(previous['saved'])).days > drift_params['max_model_age_days']:
+        return False
+
+    fcast = forecast().set_index('ds')
+    if not {'yhat', 'yhat_lower', 'yhat_upper'} <= set(fcast.columns):
+        return False
+
+    dates = pd.to_datetime(hist.Date)
+    new = pd.DataFrame({'y': hist.Close.values}, index=dates)[dates.values > pd.Timestamp(previous['last_date'])]
+    joined = new.join(fcast, how='inner')
+    if not len(joined) or len(joined) < len(new):
+        return False  # history revised, or new prices beyond the stored forecast
+
+    breach_rate = ((joined.y < joined.yhat_lower) | (joined.y > joined.yhat_upper)).mean()
+    error = ((joined.y - joined.yhat).abs() / joined.yhat.abs()).mean()
+    return breach_rate <= drift_params['max_breach_rate'] and error <= drift_params['max_error']
 
 def _transform_fit(item):
 
-        name, data = item
-        # try:
-        _data = _transform_model_input(data())
-        return (name, _fit_prophet_model(_data))
-        # except:
-        #     log.error(f"{name} failed Prophet processing")
+    name, data, input_hash, previous, forecast, prophet_params = item
+    hist = data()
+    if prophet_params['drift']['enabled'] and _within_forecast(hist, forecast, previous, prophet_params['drift']):
+        return (name, None, {'within_forecast': True})
 
-def apply_prophet_model(datasets: Dict[str, Any]) -> Dict[str, pd.DataFrame]:
-    '''Loop through historic data and apply prophet model'''
+    last_date = pd.to_datetime(hist.Date).max().strftime('%Y-%m-%d')
+    init = previous.get('init') if prophet_params['warm_start'] else None
+    _data = _transform_model_input(hist, prophet_params)
+    rss_before, peak_reset = _rss_mb(), _reset_peak_rss()
+    model, seconds, warm, output = _fit_prophet_model(_data, prophet_params, init)
 
-    try:
-        pool = Pool(os.cpu_count() - 1)
-        forecasts = pool.map(_transform_fit, datasets.items())
-        log.info(f"{len(forecasts)} processed with Prophet")
+    meta = {
+        'input_hash': input_hash,
+        'init': _stan_init(model),
+        'fit_seconds': seconds,
+        'input_rows': len(_data),
+        'last_date': last_date,
+        'warm': warm,
+        # latest cold fit time, to estimate time saved by warm starts
+        'cold_seconds': previous.get('cold_seconds', seconds) if warm else seconds,
+        **_stan_stats(output),
+        **_process_stats(rss_before, peak_reset),
+    }
+    return (name, model_to_json(model), meta)
+
+def fit_prophet_models(
+    datasets: Dict[str, Any], data_manifest: Dict[str, Dict], manifest: Dict[str, Dict], failures: Dict[str, Dict],
+    forecasts: Dict[str, Any], prophet_params: Dict
+    ) -> Iterator[Tuple]:
+    '''Loop through historic data and fit prophet models, keeping stored models of unchanged series
+    and warm-starting fits from the previous fitted parameters. Unchanged series, whose historical manifest hash
+    and model configuration match the stored model's, are never dispatched. With drift enabled, stored models whose
+    forecast still explains the new prices are also kept. Series are dispatched longest expected fit first,
+    so long fits do not finish last on one worker. Models are yielded as each fit completes;
+    failed series are yielded without a model, and skipped while quarantined.
+
+    With backend 'band', all series are instead fitted at once with the vectorized band model'''
+
+    if prophet_params['backend'] == 'band':
+        yield from fit_band_models(datasets, data_manifest, prophet_params['band'])
+        return
+
+    executor_params = prophet_params['executor']
+    quarantined = _quarantined(failures, executor_params)
+    if quarantined:
+        log.warning(f"{len(quarantined)} quarantined after repeated failures, skipped: {', '.join(sorted(quarantined))}")
+
+    hashes = {name: _input_hash(data_manifest.get(name, {}), prophet_params) for name in datasets}
+    unchanged = {
+        name for name, input_hash in hashes.items()
+        if input_hash is not None and input_hash == manifest.get(name, {}).get('input_hash')
+    }
+
+    names = [name for name in datasets if name not in quarantined | unchanged]
+    costs = _fit_costs(names, manifest, data_manifest)
+    items = {
+        name: (name, datasets[name], hashes[name], manifest.get(name, {}), forecasts.get(name), prophet_params)
+        for name in sorted(names, key=costs.get, reverse=True)
+    }
+
+    counts, saved = Counter({'unchanged': len(unchanged - quarantined)}), 0.0
+    for name, result, error in imap_tasks(_transform_fit, items, executor_params):
+        if error is not None:
+            log.error(f"{name} failed Prophet processing: {error}")
+            counts['failed'] += 1
+            yield (name, None, {'error': error})
+            continue
+
+        _, model, meta = result
+        if model is None:
+            counts['within forecast'] += 1
+            continue
+
+        counts['fitted'] += 1
+        if meta['warm']:
+            counts['warm'] += 1
+            saved += meta['cold_seconds'] - meta['fit_seconds']
+        yield (name, model, meta)
+
+    log.info(
+        f"{counts['fitted']} fitted with Prophet, {counts['unchanged']} unchanged, "
+        f"{counts['within forecast']} within forecast, {counts['failed']} failed"
+    )
+    log.info(f"{counts['warm']} of {counts['fitted']} fits warm-started, saving an estimated {saved:.1f}s of optimizer time")
 
-    finally:
-        pool.close()
-        pool.join()
+def _transform_predict(item):
 
-    return dict(forecasts)
+    name, model, prophet_params = item
+    model = model_from_json(model())
+    start = time.perf_counter()
+    forecast = _predict_prophet_model(model, prophet_params)
+    return (name, forecast, time.perf_counter() - start)
 
+def predict_prophet_models(
+    models: Dict[str, Any], models_manifest: Dict[str, Dict], manifest: Dict[str, Dict], prophet_params: Dict
+    ) -> Iterator[Tuple]:
+    '''Forecast with stored prophet models, skipping models unchanged since their stored forecast.
+    Forecasts are yielded as each completes; failed forecasts are yielded without data'''
+
+    meta = {name: _forecast_meta(models_manifest[name]['hash'], prophet_params) for name in models}
+    items = {
+        name: (name, model, prophet_params) for name, model in models.items()
+        if any(manifest.get(name, {}).get(key) != value for key, value in meta[name].items())
+    }
+
+    band = [name for name in items if models_manifest[name].get('backend') == 'band']
+    for name in band:
+        yield (name, predict_band_model(json.loads(items.pop(name)[1]()), prophet_params), meta[name])
+
+    failed = 0
+    for name, result, error in imap_tasks(_transform_predict, items, prophet_params['executor']):
+        if error is not None:
+            log.error(f"{name} failed Prophet forecast: {error}")
+            failed += 1
+            yield (name, None, {'error': error})
+            continue
+        _, fcast, seconds = result
+        yield (name, fcast, {**meta[name], 'predict_seconds': seconds})
+
+    log.info(f"{len(band)} forecast with band models, {len(items) - failed} with Prophet, "
+             f"{len(models) - len(items) - len(band)} unchanged, {failed} failed")
+
+def predict_prophet_dates(
+    models: Dict[str, Any], models_manifest: Dict[str, Dict], prophet_params: Dict, predict_params: Dict
+    ) -> pd.DataFrame:
+    '''Forecast requested dates (default today) with stored prophet or band models, without refitting'''
+
+    dates = pd.to_datetime(predict_params['dates'] or [pd.to_datetime('today').normalize()])
+    future = pd.DataFrame({'ds': dates})
+
+    lst = []
+    for name, model in models.items():
+        if models_manifest[name].get('backend') == 'band':
+            fcast = band_forecast(json.loads(model()), dates, prophet_params['columns']).reset_index()
+        else:
+            fcast = model_from_json(model()).predict(future)[['ds', *prophet_params['columns']]]
+        fcast['name'] = name
+        lst.append(fcast)
+
+    log.info(f"{len(lst)} forecast with stored models for {len(dates)} dates")
+
+    if not lst:  # e.g. no models fitted yet
+        return pd.DataFrame({
+            'ds': pd.Series(dtype='datetime64[ns]'),
+            **{column: pd.Series(dtype='float64') for column in prophet_params['columns']},
+            'name': pd.Series(dtype='object'),
+        })
+    return pd.concat(lst)
+
+
+def _transform_evaluate(item):
+
+    name, data, prophet_params, variants = item
+    hist = data()
+
+    results = {}
+    for variant, settings in [('full', {'lookback_years': None, 'resample': None}), *variants.items()]:
+        params = {**prophet_params, **settings, 'history_days': 0, 'columns': ['yhat']}
+        _data = _transform_model_input(hist.copy(), params)
+        model, seconds, _, _ = _fit_prophet_model(_data, params)
+        results[variant] = (len(_data), seconds, _predict_prophet_model(model, params).yhat)
+
+    full_rows, full_seconds, full_yhat = results.pop('full')
+    return [
+        {
+            'name': name,
+            'variant': variant,
+            'rows': rows,
+            'fit_seconds': seconds,
+            'fit_ratio': seconds / full_seconds,
+            'forecast_diff_pct': 100 * ((yhat - full_yhat).abs() / full_yhat.abs()).mean(),
+        }
+        for variant, (rows, seconds, yhat) in results.items()
+    ]
+
+def evaluate_training_windows(datasets: Dict[str, Any], prophet_params: Dict, evaluation_params: Dict) -> pd.DataFrame:
+    '''Compare fit time and forecast of each training window variant against a full daily history fit,
+    on an evenly spaced sample of series'''
+
+    names = sorted(datasets)
+    names = names[::max(len(names) // evaluation_params['sample'], 1)][:evaluation_params['sample']]
+    items = {name: (name, datasets[name], prophet_params, evaluation_params['variants']) for name in names}
+
+    rows = []
+    for name, result, error in imap_tasks(_transform_evaluate, items, prophet_params['executor']):
+        if error is not None:
+            log.error(f"{name} failed Prophet evaluation: {error}")
+            continue
+        rows.extend(result)
+
+    report = pd.DataFrame(rows, columns=['name', 'variant', 'rows', 'fit_seconds', 'fit_ratio', 'forecast_diff_pct'])
+    if report.empty:
+        log.warning("No series evaluated: every sampled series failed, or there are none")
+        return report
+
+    for variant, group in report.groupby('variant'):
+        log.info(
+            f"{variant}: median fit time {group.fit_ratio.median():.0%} of full history, "
+            f"median forecast difference {group.forecast_diff_pct.median():.2f}%"
+        )
+
+    return report
+
+def snapshot_forecasts(forecasts: Dict[str, Any], prophet_params: Dict) -> pd.DataFrame:
+    '''Compact table of every stored forecast up to snapshot_days ahead, one row per ETF and date,
+    so reporting reads one file rather than every forecast'''
+
+    end = pd.Timestamp.today().normalize() + pd.Timedelta(days=prophet_params['snapshot_days'])
+    lst = [data(filters=[('ds', '<=', end)]).assign(name=name) for name, data in forecasts.items()]
+    log.info(f"{len(lst)} forecasts in snapshot up to {end:%Y-%m-%d}")
+
+    if not lst:  # e.g. first run, or every forecast failed
+        return pd.DataFrame({
+            'ds': pd.Series(dtype='datetime64[ns]'),
+            **{column: pd.Series(dtype='float32') for column in prophet_params['columns']},
+            'name': pd.Series(dtype='object'),
+        })
+    return pd.concat(lst, ignore_index=True)
+
+def summarise_fit_stats(
+    forecasts: Dict[str, Any], models_manifest: Dict[str, Dict], forecasts_manifest: Dict[str, Dict]
+    ) -> pd.DataFrame:
+    '''Per-series fit and predict statistics of the stored Prophet models, logging percentiles of today's fits.
+    Takes the forecasts only to run after they are saved'''
+
+    columns = [
+        'input_rows', 'fit_seconds', 'warm', 'iterations', 'converged', 'peak_rss_mb', 'rss_delta_mb', 'worker',
+    ]
+    rows = [
+        {
+            'name': name,
+            'saved': entry['saved'],
+            **{column: entry.get(column) for column in columns},
+            'predict_seconds': forecasts_manifest.get(name, {}).get('predict_seconds'),
+        }
+        for name, entry in sorted(models_manifest.items()) if 'fit_seconds' in entry
+    ]
+    stats = pd.DataFrame(rows, columns=['name', 'saved', *columns, 'predict_seconds'])
+
+    today = stats[stats.saved == pd.Timestamp.today().strftime('%Y-%m-%d')]
+    for column in ['input_rows', 'fit_seconds', 'iterations', 'peak_rss_mb', 'rss_delta_mb']:
+        values = pd.to_numeric(today[column]).dropna()
+        if len(values):
+            p50, p95 = values.quantile([0.5, 0.95])
+            log.info(f"{len(values)} fits today, {column}: p50 {p50:.1f}, p95 {p95:.1f}, max {values.max():.1f}")
+    not_converged = today[today.converged == False].name  # noqa: E712
+    if len(not_converged):
+        log.warning(f"Optimizer did not converge: {', '.join(not_converged)}")
+
+    return stats
 
 
 ############################################################
@@ -88,6 +485,31 @@ class suppress_stdout_stderr(object):
         os.close(self.null_fds[1])
 
 
+class capture_stdout_stderr(suppress_stdout_stderr):
+    '''
+    suppress_stdout_stderr, keeping what was printed (e.g. Stan optimizer
+    progress) in `output` rather than discarding it.
+    '''
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.save_fds = (os.dup(1), os.dup(2))
+        self.null_fds = [self.file.fileno()] * 2
+        self.output = ''
+
+    def __enter__(self):
+        super().__enter__()
+        return self
+
+    def __exit__(self, *_):
+        os.dup2(self.save_fds[0], 1)
+        os.dup2(self.save_fds[1], 2)
+        os.close(self.save_fds[0])
+        os.close(self.save_fds[1])
+        self.file.seek(0)
+        self.output = self.file.read().decode(errors='replace')
+        self.file.close()
+
+
 
 
 
@@ -1,17 +1,67 @@
 from kedro.pipeline import node, Pipeline
 
 from .nodes import (
-    apply_prophet_model,
+    evaluate_training_windows,
+    fit_prophet_models,
+    predict_prophet_models,
+    predict_prophet_dates,
+    snapshot_forecasts,
+    summarise_fit_stats,
 )
 
 def create_pipeline(**kwargs) -> Pipeline:
     return Pipeline(
         [
             node(
-                func=apply_prophet_model,
-                inputs='etf_historical',
-                outputs='etf_forecasts',
+                func=fit_prophet_models,
+                inputs=[
+                    'etf_historical', 'etf_historical_manifest', 'etf_prophet_models_manifest',
+                    'etf_prophet_models_failures', 'etf_forecasts_stored', 'params:prophet_params'
+                ],
+                outputs='etf_prophet_models',
                 name='prophet_etfs'
             ),
+            node(
+                func=predict_prophet_models,
+                inputs=['etf_prophet_models', 'etf_prophet_models_manifest', 'etf_forecasts_manifest', 'params:prophet_params'],
+                outputs='etf_forecasts',
+                name='prophet_etfs_forecast'
+            ),
+            node(
+                func=snapshot_forecasts,
+                inputs=['etf_forecasts', 'params:prophet_params'],
+                outputs='etf_forecast_snapshot',
+                name='prophet_etfs_snapshot'
+            ),
+            node(
+                func=summarise_fit_stats,
+                inputs=['etf_forecasts', 'etf_prophet_models_manifest', 'etf_forecasts_manifest'],
+                outputs='prophet_fit_stats',
+                name='prophet_etfs_fit_stats'
+            ),
+        ]
+    )
+
+def create_predict_pipeline(**kwargs) -> Pipeline:
+    return Pipeline(
+        [
+            node(
+                func=predict_prophet_dates,
+                inputs=['etf_prophet_models', 'etf_prophet_models_manifest', 'params:prophet_params', 'params:predict_params'],
+                outputs='etf_predictions',
+                name='prophet_etfs_predict'
+            ),
+        ]
+    )
+
+def create_evaluation_pipeline(**kwargs) -> Pipeline:
+    return Pipeline(
+        [
+            node(
+                func=evaluate_training_windows,
+                inputs=['etf_historical', 'params:prophet_params', 'params:evaluation_params'],
+                outputs='etf_prophet_evaluation',
+                name='prophet_etfs_evaluation'
+            ),
         ]
-    )
\ No newline at end of file
+    )
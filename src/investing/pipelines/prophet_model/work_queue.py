@@ -0,0 +1,250 @@
+import logging
+import os
+import pickle
+import socket
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+LEASE_GRACE_SECONDS = 10  # leases outlast the task time limit, so a worker records its own timeout first
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    run TEXT NOT NULL,
+    name TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    lease_seconds REAL NOT NULL,
+    leased_until REAL,
+    worker TEXT,
+    result BLOB,
+    error TEXT,
+    PRIMARY KEY (run, name)
+)
+'''
+
+
+def _expire(db: sqlite3.Connection, now: float):
+    '''Fail running tasks whose lease expired without attempts left: their worker died or hung'''
+    db.execute(
+        '''UPDATE tasks SET status = 'failed', error = 'TimeoutError: lease expired'
+        WHERE status = 'running' AND leased_until < ? AND attempts >= max_attempts''',
+        (now,)
+    )
+
+
+class WorkQueue:
+    '''SQLite-backed task queue shared by the pipeline, which publishes tasks and collects results,
+    and any number of `kedro worker` processes, which claim and run them.
+
+    A worker lets a claimed task run for lease_seconds, and holds it on a slightly longer lease; a task whose
+    worker died past its lease is claimed again, until max_attempts is reached. Tasks are claimed in the order
+    they were published.
+    '''
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as db:
+            db.execute(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+
+    def publish(self, func: Callable, items: Dict[str, Tuple], max_attempts: int, lease_seconds: float) -> str:
+        '''Queue func(item) for each item, returning the run id to collect results with'''
+
+        run = uuid.uuid4().hex
+        rows = [
+            (run, name, pickle.dumps((func, item)), max_attempts, lease_seconds)
+            for name, item in items.items()
+        ]
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany(
+                'INSERT INTO tasks (run, name, payload, max_attempts, lease_seconds) VALUES (?, ?, ?, ?, ?)', rows
+            )
+            db.execute('COMMIT')
+        return run
+
+    def claim(self, worker: str) -> Optional[Tuple[str, str, bytes, float]]:
+        '''Lease the next pending task, or expired task with attempts left, returning its run, name, pickled
+        (func, item) payload and lease seconds; None when there is none'''
+
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            _expire(db, now)
+            row = db.execute(
+                '''SELECT rowid, run, name, payload, lease_seconds FROM tasks
+                WHERE status = 'pending' OR (status = 'running' AND leased_until < ?)
+                ORDER BY rowid LIMIT 1''',
+                (now,)
+            ).fetchone()
+            if row is not None:
+                db.execute(
+                    '''UPDATE tasks SET status = 'running', attempts = attempts + 1, worker = ?,
+                    leased_until = ? + lease_seconds WHERE rowid = ?''',
+                    (worker, now + LEASE_GRACE_SECONDS, row[0])
+                )
+            db.execute('COMMIT')
+
+        if row is None:
+            return None
+        return row[1:]
+
+    def complete(self, run: str, name: str, result: Any = None, error: Optional[str] = None):
+        '''Store a task's result; a failed task with attempts left is queued again'''
+
+        with closing(self._connect()) as db:
+            if error is None:
+                db.execute(
+                    "UPDATE tasks SET status = 'done', result = ?, payload = x'' WHERE run = ? AND name = ?",
+                    (pickle.dumps(result), run, name)
+                )
+            else:
+                db.execute(
+                    '''UPDATE tasks SET error = ?,
+                    status = CASE WHEN attempts < max_attempts THEN 'pending' ELSE 'failed' END
+                    WHERE run = ? AND name = ?''',
+                    (error, run, name)
+                )
+
+    def collect(
+        self, run: str, poll_seconds: float, run_timeout: Optional[float] = None
+        ) -> Iterator[Tuple[str, Any, Optional[str]]]:
+        '''Yield (name, result, error) for each task of the run as it finishes, removing it from the queue.
+
+        Tasks not finished within run_timeout seconds (no limit when not set) fail, e.g. when no worker is running.
+        '''
+
+        deadline = time.time() + run_timeout if run_timeout is not None else None
+        logged = False
+        while True:
+            now = time.time()
+            with closing(self._connect()) as db:
+                db.execute('BEGIN IMMEDIATE')
+                _expire(db, now)
+                if deadline is not None and now > deadline:
+                    timed_out = db.execute(
+                        '''UPDATE tasks SET status = 'failed', error = ?
+                        WHERE run = ? AND status IN ('pending', 'running')''',
+                        (f"TimeoutError: run exceeded {run_timeout}s", run)
+                    ).rowcount
+                    if timed_out:
+                        log.error(f"{timed_out} queued tasks unfinished after {run_timeout}s, failed")
+                rows = db.execute(
+                    "SELECT name, status, result, error FROM tasks WHERE run = ? AND status IN ('done', 'failed')",
+                    (run,)
+                ).fetchall()
+                db.execute(
+                    "DELETE FROM tasks WHERE run = ? AND status IN ('done', 'failed')", (run,)
+                )
+                remaining = db.execute('SELECT COUNT(*) FROM tasks WHERE run = ?', (run,)).fetchone()[0]
+                db.execute('COMMIT')
+
+            for name, status, result, error in rows:
+                if status == 'done':
+                    yield name, pickle.loads(result), None
+                else:
+                    yield name, None, error
+
+            if not remaining:
+                return
+            if not rows and not logged:
+                logged = True
+                log.info(f"Waiting for {remaining} queued tasks in {self.path}, processed by `kedro worker`")
+            time.sleep(poll_seconds)
+
+
+def imap_queue(func: Callable, items: Dict[str, Tuple], executor_params: Dict) -> Iterator[Tuple[str, Any, Optional[str]]]:
+    '''Publish func over items to the work queue, yielding (name, result, error) as workers complete them'''
+
+    if not items:
+        return
+    queue_params = executor_params['queue']
+    work_queue = WorkQueue(queue_params['path'])
+    run = work_queue.publish(func, items, executor_params['retries'] + 1, executor_params['timeout'])
+    yield from work_queue.collect(run, queue_params['poll_seconds'], queue_params['run_timeout'])
+
+
+def _run_task(payload: bytes, sender: Connection):
+    '''Child side of a task: unpickle and run it, sending back (result, error)'''
+
+    try:
+        func, item = pickle.loads(payload)
+        sender.send((func(item), None))
+    except Exception as e:
+        sender.send((None, f"{type(e).__name__}: {e}"))
+
+
+def _run_in_child(payload: bytes, timeout: float) -> Tuple[Any, Optional[str]]:
+    '''Run a pickled task in a child process, so a task that cannot be unpickled, crashes or runs longer
+    than timeout seconds fails alone instead of taking the worker down'''
+
+    receiver, sender = Pipe(duplex=False)
+    process = Process(target=_run_task, args=(payload, sender))
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            return None, f"TimeoutError: exceeded {timeout}s"
+        return receiver.recv()
+    except EOFError:
+        process.join()
+        return None, f"ChildProcessError: task process exited with code {process.exitcode}"
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def serve(path: str, poll_seconds: float):
+    '''Worker loop: claim queued tasks and run each in a child process, limited to its lease, until interrupted'''
+
+    work_queue = WorkQueue(path)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    log.info(f"Worker {worker} processing tasks from {path}")
+
+    try:
+        while True:
+            task = work_queue.claim(worker)
+            if task is None:
+                time.sleep(poll_seconds)
+                continue
+
+            run, name, payload, lease_seconds = task
+            result, error = _run_in_child(payload, lease_seconds)
+            if error is not None:
+                log.warning(f"{name} failed on {worker}: {error}")
+            work_queue.complete(run, name, result, error)
+    except KeyboardInterrupt:
+        log.info(f"Worker {worker} stopped")
+
+
+def run_workers(path: str, workers: int, poll_seconds: float):
+    '''Run worker loops in `workers` processes until interrupted'''
+
+    # not daemonic: each worker runs its tasks in child processes
+    processes = [Process(target=serve, args=(path, poll_seconds)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+            process.join()
@@ -1,57 +1,209 @@
 import logging
-from collections import namedtuple
-from statistics import median
-from typing import Any, Dict, ItemsView
+from collections import Counter
+from typing import Any, Callable, Dict, ItemsView, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 
+from investing.extras.datasets.partitioned_dataset import row_hash_sum
+from investing.extras.master_table import MasterTable
+
 log = logging.getLogger(__name__)
 
 
-def extract_historical_meta(datasets: Dict[str, Any]) -> pd.DataFrame:
-    '''extract useful meta data from historical prices, such as expected annual return rate and years of data'''
+YEARLY_SUMS = ['ret_n', 'ret_sum', 'ret_sumsq', 'vol_sum', 'vol_n']
+DAY_RANGE = ['day_low', 'day_high']  # always reported, as the default day range source
+
+
+def _read_since(data: Any, start: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    '''Historical prices dated on or after start (all when not set), reading only those rows'''
+
+    hist = data() if start is None else data(filters=[('Date', '>=', start)])
+    hist['Date'] = pd.to_datetime(hist.Date)
+    return hist.sort_values('Date', ignore_index=True)
+
+
+def _yearly(closes: np.ndarray, returns: np.ndarray, prices: pd.DataFrame) -> pd.DataFrame:
+    '''Daily rows of the yearly state columns: close range and daily returns and volumes, to be summed by year'''
+
+    return pd.DataFrame({
+        'Year': prices.Date.dt.year.to_numpy(),
+        'min': closes,
+        'max': closes,
+        'ret_n': np.isfinite(returns).astype(int),
+        'ret_sum': np.nan_to_num(returns),
+        'ret_sumsq': np.nan_to_num(returns) ** 2,
+        'vol_sum': prices.Volume.fillna(0).to_numpy(),
+        'vol_n': prices.Volume.notna().astype(int).to_numpy(),
+    })
+
+
+YEARLY_AGG = {'min': 'min', 'max': 'max', **{column: 'sum' for column in YEARLY_SUMS}}
+
+
+def _build_states(hist: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    '''Metric states of many ETFs at once, from their full histories (symbol column), in one grouped pass:
+    one row per ETF and year with the close range and sums of daily returns and volumes, plus the first and
+    last prices, peak, max drawdown and row hash sum (as recorded in the historical manifest) of each ETF'''
+
+    hist = hist.sort_values(['symbol', 'Date'], ignore_index=True)
+    symbols = hist.pop('symbol')
+    codes, names = pd.factorize(symbols)
+    hashes = np.zeros(len(names), dtype='uint64')
+    np.add.at(hashes, codes, pd.util.hash_pandas_object(hist, index=False).to_numpy())
+
+    closes = hist.Close.astype('float64')
+    grouped = closes.groupby(symbols, sort=False)
+    returns = (closes / grouped.shift(1) - 1).to_numpy()
+    yearly = _yearly(closes.to_numpy(), returns, hist).assign(symbol=symbols.to_numpy())
+    yearly = yearly.groupby(['symbol', 'Year']).agg(YEARLY_AGG).reset_index()
+
+    first, last = hist.groupby(symbols, sort=False).nth(0), hist.groupby(symbols, sort=False).nth(-1)
+    scalars = pd.DataFrame({
+        'rows': grouped.size(),
+        'first_date': first.Date,
+        'first_close': first.Close.astype('float64'),
+        'last_date': last.Date,
+        'last_close': last.Close.astype('float64'),
+        'last_low': last.Low,
+        'last_high': last.High,
+        'peak': grouped.max().fillna(-np.inf),
+        'max_drawdown': (closes / grouped.cummax() - 1).groupby(symbols).min().fillna(0).clip(upper=0),
+        'row_hash_sum': pd.Series(hashes, index=names),
+    })
+
+    states = yearly.join(scalars, on='symbol')
+    return {name: frame.drop(columns='symbol').reset_index(drop=True) for name, frame in states.groupby('symbol')}
+
+
+def _update_state(state: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    '''Fold new daily prices into an ETF's metric state, as built by `_build_states`'''
+
+    closes = new.Close.to_numpy(dtype='float64')
+    scalars = state.iloc[0]
+    first_date, first_close, rows = scalars.first_date, scalars.first_close, scalars.rows
+    last_close, peak, drawdown = scalars.last_close, scalars.peak, scalars.max_drawdown
+    hashes = int(scalars.row_hash_sum)
+
+    returns = closes / np.r_[last_close, closes[:-1]] - 1
+    yearly = pd.concat([state[['Year', *YEARLY_AGG]], _yearly(closes, returns, new)])
+    yearly = yearly.groupby('Year').agg(YEARLY_AGG)
+
+    peaks = np.fmax.accumulate(np.r_[peak, closes])[1:]
+    latest = new.iloc[-1]
+    return yearly.reset_index().assign(
+        rows=rows + len(new),
+        first_date=first_date,
+        first_close=first_close,
+        last_date=latest.Date,
+        last_close=latest.Close,
+        last_low=latest.Low,
+        last_high=latest.High,
+        peak=peaks[-1],
+        max_drawdown=min(drawdown, np.nanmin(np.r_[0, closes / peaks - 1])),
+        row_hash_sum=np.uint64((hashes + row_hash_sum(new)) % 2 ** 64),
+    )
+
+
+def _state_metrics(states: Dict[str, pd.DataFrame], report_params: Dict) -> pd.DataFrame:
+    '''Historical metrics of all ETFs at once from their metric states; the configured metrics plus the day range'''
+
+    metrics = list(dict.fromkeys([*report_params['historical_metrics'], *DAY_RANGE]))
+    if not states:
+        return pd.DataFrame(columns=['name', *metrics])
+
+    state = pd.concat(states, names=['name']).reset_index(level='name')
+    recent = state[state.Year > state.groupby('name').Year.transform('max') - report_params['metric_years']]
+    scalars = state.groupby('name').first()
+    sums = recent.groupby('name')[YEARLY_SUMS].sum()
+    span = (scalars.last_date - scalars.first_date).dt.days
+
+    meta = pd.DataFrame(index=scalars.index)
+    meta['volatility'] = ((recent['max'] - recent['min']) / recent['min']).groupby(recent.name).median()
+    meta['age'] = span / 365
+    meta['day_low'], meta['day_high'] = scalars.last_low, scalars.last_high
+    meta['cagr'] = (scalars.last_close / scalars.first_close) ** (365.25 / span.where(span > 0)) - 1
+    meta['max_drawdown'] = scalars.max_drawdown
+    n = sums.ret_n.where(sums.ret_n > 1)
+    meta['annual_stdev'] = ((sums.ret_sumsq - sums.ret_sum ** 2 / n) / (n - 1)) ** 0.5 * 252 ** 0.5
+    meta['avg_volume'] = sums.vol_sum / sums.vol_n.where(sums.vol_n > 0)
+
+    return meta[metrics].reset_index()
+
 
-    Row = namedtuple('Row', 'name volatility age')
-    rows = []
+def update_historical_meta(
+    historical: Dict[str, Any], historical_reader: Callable[..., pd.DataFrame], historical_manifest: Dict[str, Dict],
+    state: pd.DataFrame, report_params: Dict
+    ) -> Tuple[pd.DataFrame, List[Tuple[str, pd.DataFrame]]]:
+    '''extract useful meta data from historical prices, such as expected annual return rate, years of data and latest day range.
+    Each ETF's metric state is updated with only the prices added since it was saved, read from its partition. ETFs whose
+    earlier prices were revised, or the manifest cannot tell, are rebuilt together from one read of their full histories
+    (historical_reader, given the partitions to read). Metrics are then computed for all ETFs at once from the states.
 
-    def _volatility(hist, years=5):
-        hist['Year'] = hist.Date.dt.year
-        xyrs = hist[hist.Year > (max(hist.Year) - years)]
-        grouped = xyrs.groupby('Year')
-        mn, mx = grouped.Close.min(), grouped.Close.max()
-        return median((mx - mn) / mn)
+    The state's row hash sum, plus that of the rows read since, must equal the manifest's for the stored rows to be unchanged'''
 
-    def _age(hist):
-        start, latest = min(hist.Date), max(hist.Date)
-        return (latest - start).days / 365
+    states = {
+        name: frame.drop(columns='symbol').reset_index(drop=True)
+        for name, frame in (state.groupby('symbol') if len(state) else [])
+    }
 
-    for name, data in datasets.items():
-        hist = data()
-        hist.Date = pd.to_datetime(hist.Date)
-        volatility = _volatility(hist)
-        age = _age(hist)
-        rows.append(Row(name, volatility, age))
+    updated, counts, rebuild = [], Counter(), []
+    for name, data in historical.items():
+        entry = historical_manifest.get(name, {})
+        previous = states.get(name)
 
-    df = pd.DataFrame(data=rows)
+        if previous is not None and 'row_hash_sum' in previous and 'row_hash_sum' in entry:
+            scalars = previous.iloc[0]
+            hashes = int(scalars.row_hash_sum)
+            if entry['row_hash_sum'] == hashes:
+                counts['unchanged'] += 1
+                continue
 
-    return df
+            # new prices follow on from the stored last price, and nothing up to it changed
+            new = _read_since(data, scalars.last_date)
+            continues = (
+                len(new) > 1
+                and new.Date.iloc[0] == scalars.last_date
+                and entry['row_hash_sum'] == (hashes + row_hash_sum(new.iloc[1:])) % 2 ** 64
+            )
+            if continues:
+                states[name] = _update_state(previous, new.iloc[1:])
+                counts['updated'] += 1
+                updated.append((name, states[name]))
+                continue
 
+        rebuild.append(name)
 
-def extract_prophet_output(forecasts: Dict) -> pd.DataFrame:
-    '''Combine prophet model outputs, selecting todays forecast'''
+    hist = historical_reader(partitions=rebuild) if rebuild else pd.DataFrame()
+    if len(hist):
+        hist['Date'] = pd.to_datetime(hist.Date)
+        rebuilt = _build_states(hist)
+        states.update(rebuilt)
+        counts['rebuilt'] += len(rebuilt)
+        updated.extend(rebuilt.items())
 
-    today = pd.to_datetime('today').strftime("%Y-%m-%d")
+    log.info(f"Historical metrics: {counts['updated']} updated, {counts['rebuilt']} rebuilt, {counts['unchanged']} unchanged")
 
-    lst = []
-    for name, data in forecasts.items():
-        fcast = data()
-        fcast = fcast[fcast.ds == today]
-        if len(fcast) == 0:
-            log.warn(f"Forecast contains no data for today ({today}): {name}")
-        fcast['name'] = name
-        lst.append(fcast)
+    meta = _state_metrics({name: states[name] for name in historical if name in states}, report_params)
+    return meta, updated
 
-    return pd.concat(lst)
+
+def extract_prophet_output(snapshot: pd.DataFrame, forecast_date: Optional[str]) -> pd.DataFrame:
+    '''Select each ETF's forecast for the forecast date (default today), or for its nearest forecast date'''
+
+    date = pd.to_datetime(forecast_date or 'today').normalize()
+
+    snapshot = snapshot.assign(distance=(pd.to_datetime(snapshot.ds) - date).abs())
+    fcast = snapshot.sort_values(['name', 'distance', 'ds']).groupby('name').head(1).drop(columns='distance')
+
+    nearest = fcast[fcast.ds != date]
+    if len(nearest):
+        log.warning(
+            f"Forecast contains no data for {date:%Y-%m-%d}, using the nearest date: "
+            + ', '.join(f"{row.name} ({row.ds:%Y-%m-%d})" for row in nearest.itertuples())
+        )
+
+    return fcast
 
 
 def combine_etf_outputs(
@@ -61,16 +213,20 @@ def combine_etf_outputs(
     etf_historical_meta: pd.DataFrame,
     current_holdings: pd.DataFrame,
     ) -> pd.DataFrame:
-    '''Combine etfs, forecasts and information to create a master table'''
-
-    merge1 = pd.merge(etfs, etf_information, left_on='name', right_on='ETF Name', how='left', suffixes=('_source', ''))
-    merge2 = pd.merge(merge1, forecast, on='name', how='left', suffixes=('', '_forecast'))
-    merge3 = pd.merge(merge2, etf_historical_meta, on='name', how='left')
-    merge4 = pd.merge(merge3, current_holdings, on=['symbol_ft', 'stock_exchange'], how='left')
-    return merge4
+    '''Combine etfs, forecasts and information to create a master table; a table not unique on its keys
+    raises a MergeError'''
+
+    return (
+        MasterTable(etfs)
+        .join(etf_information, left_on=['name'], right_on=['ETF Name'], suffixes=('_source', ''))
+        .join(forecast, on=['name'], suffixes=('', '_forecast'))
+        .join(etf_historical_meta, on=['name'])
+        .join(current_holdings, on=['symbol_ft', 'stock_exchange'])
+        .build()
+    )
 
 
-def clean_etf_summary(etf_combined_data: pd.DataFrame) -> pd.DataFrame:
+def clean_etf_summary(etf_combined_data: pd.DataFrame, report_params: Dict) -> pd.DataFrame:
     '''select & rename columns, and extract the days highs and lows'''
 
     # Filter columns to keep
@@ -96,6 +252,12 @@ def clean_etf_summary(etf_combined_data: pd.DataFrame) -> pd.DataFrame:
             'name',
             'volatility',
             'age',
+            'day_low',
+            'day_high',
+            'cagr',
+            'max_drawdown',
+            'annual_stdev',
+            'avg_volume',
             'shares_held',
         ], 
         axis=1,
@@ -111,13 +273,16 @@ def clean_etf_summary(etf_combined_data: pd.DataFrame) -> pd.DataFrame:
         inplace=True
     )
 
-    # Split day range to extract high and low
-    summary[['day_low', 'day_high']] = (
-        summary['Todays Range']
-        .str.split(' - ', 1, expand=True)
-        .replace({',': ''}, regex=True)
-        .astype('float32')
-    )
+    # Split day range to extract high and low, unless taken from latest historical prices
+    if report_params['day_range_source'] == 'information':
+        summary[['day_low', 'day_high']] = (
+            summary['Todays Range']
+            .str.split(' - ', 1, expand=True)
+            .replace({',': ''}, regex=True)
+            .astype('float32')
+        )
+    else:
+        summary[['day_low', 'day_high']] = summary[['day_low', 'day_high']].astype('float32')
     summary.drop(['Todays Range'], axis='columns', inplace=True)
 
     # tidy column names
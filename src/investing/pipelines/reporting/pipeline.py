@@ -1,7 +1,7 @@
 from kedro.pipeline import node, Pipeline
 
 from .nodes import (
-    extract_historical_meta,
+    update_historical_meta,
     extract_prophet_output,
     combine_etf_outputs,
     clean_etf_summary,
@@ -14,14 +14,14 @@ def create_pipeline(**kwargs) -> Pipeline:
     return Pipeline(
         [
             node(
-                func=extract_historical_meta,
-                inputs='etf_historical',
-                outputs='etf_historical_meta',
+                func=update_historical_meta,
+                inputs=['etf_historical', 'etf_historical_reader', 'etf_historical_manifest', 'etf_metrics_state_stored', 'params:report_params'],
+                outputs=['etf_historical_meta', 'etf_metrics_state'],
                 name='extract_etfs_historical_meta'
             ),
             node(
                 func=extract_prophet_output,
-                inputs='etf_forecasts',
+                inputs=['etf_forecast_snapshot', 'params:forecast_date'],
                 outputs='etf_forecast_master',
                 name='extract_etfs_forecast'
             ),
@@ -33,7 +33,7 @@ def create_pipeline(**kwargs) -> Pipeline:
             ),
             node(
                 func=clean_etf_summary,
-                inputs='etf_combined_data',
+                inputs=['etf_combined_data', 'params:report_params'],
                 outputs='etf_summary_cleaned',
                 name='etf_summary_cleaned'
             ),
@@ -0,0 +1,60 @@
+import os
+import time
+
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from investing.extras.datasets.cache_dataset import TTLCacheDataSet
+
+
+class _Download:
+    def __init__(self, data):
+        self.data = data
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.data
+
+
+def _age(path, days):
+    stamp = time.time() - days * 24 * 60 * 60
+    os.utime(path, (stamp, stamp))
+
+
+def test_fresh_cache_does_not_call_download(tmp_path):
+    path = tmp_path / "etfs.pkl.gz"
+    cache = TTLCacheDataSet(str(path), ttl_days=7)
+    cached = pd.DataFrame({"name": ["cached"]})
+    cache.save(cached)
+    _age(path, 6)
+
+    download = _Download(pd.DataFrame({"name": ["downloaded"]}))
+    cache.save(download)
+
+    assert download.calls == 0
+    assert_frame_equal(cache.load(), cached)
+
+
+def test_stale_cache_calls_download_once(tmp_path):
+    path = tmp_path / "etfs.pkl.gz"
+    cache = TTLCacheDataSet(str(path), ttl_days=7)
+    cache.save(pd.DataFrame({"name": ["cached"]}))
+    _age(path, 8)
+
+    download = _Download(pd.DataFrame({"name": ["downloaded"]}))
+    cache.save(download)
+    cache.save(download)
+
+    assert download.calls == 1
+    assert cache.load().name.tolist() == ["downloaded"]
+
+
+def test_saving_a_frame_always_overwrites(tmp_path):
+    # the --refresh-universe path: the node downloads and returns the frame itself
+    cache = TTLCacheDataSet(str(tmp_path / "nested" / "etfs.pkl.gz"), ttl_days=7)
+    cache.save(pd.DataFrame({"name": ["cached"]}))
+
+    cache.save(pd.DataFrame({"name": ["refreshed"]}))
+
+    assert cache.load().name.tolist() == ["refreshed"]
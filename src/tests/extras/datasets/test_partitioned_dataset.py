@@ -0,0 +1,170 @@
+import json
+
+import pandas as pd
+import pytest
+
+from investing.extras.datasets.partitioned_dataset import (
+    ManifestDataSet,
+    ParquetPartitionedDataSet,
+    SnapshotPartitionedDataSet,
+    StreamingPartitionedDataSet,
+)
+
+
+@pytest.fixture
+def json_partitions(tmp_path):
+    return StreamingPartitionedDataSet(
+        path=str(tmp_path), dataset="json.JSONDataSet", filename_suffix=".json", use_manifest=True
+    )
+
+
+def test_interrupted_save_keeps_previous_partition(tmp_path, json_partitions):
+    json_partitions.save({"a": {"price": 1}})
+
+    # not JSON serialisable: the write fails half way
+    with pytest.raises(Exception):
+        json_partitions.save({"a": {"price": object()}})
+
+    assert json.loads((tmp_path / "a.json").read_text()) == {"price": 1}
+    assert json_partitions.load()["a"]() == {"price": 1}
+    assert ManifestDataSet(str(tmp_path / "_manifest.jsonl")).load()["a"]["hash"]
+
+
+def _prices(dates, close):
+    return pd.DataFrame(
+        {"Close": close, "Volume": [100] * len(dates)},
+        index=pd.Index(pd.to_datetime(dates), name="Date"),
+    )
+
+
+@pytest.fixture
+def parquet_partitions(tmp_path):
+    return ParquetPartitionedDataSet(
+        path=str(tmp_path), date_columns=["Date"], float_dtype="float32", use_manifest=True
+    )
+
+
+def test_parquet_save_load_round_trip(tmp_path, parquet_partitions):
+    parquet_partitions.save(
+        {"a": _prices(["2021-01-04", "2021-01-05"], [1.0, 2.0]), "b": _prices(["2021-01-05"], [3.0])}
+    )
+
+    assert (tmp_path / "symbol=a" / "part.parquet").exists()
+    loaded = parquet_partitions.load()
+    assert sorted(loaded) == ["a", "b"]
+
+    a = loaded["a"]()
+    assert list(a.columns) == ["Date", "Close", "Volume"]
+    assert a.Close.dtype == "float32"
+    assert list(a.Date) == list(pd.to_datetime(["2021-01-04", "2021-01-05"]))
+    assert list(loaded["a"](filters=[("Date", ">=", pd.Timestamp("2021-01-05"))]).Close) == [2.0]
+
+    manifest = ManifestDataSet(str(tmp_path / "_manifest.jsonl")).load()
+    assert manifest["a"]["rows"] == 2
+    assert (manifest["a"]["min_date"], manifest["a"]["max_date"]) == ("2021-01-04", "2021-01-05")
+
+
+def test_streaming_save_records_manifest_and_failures(tmp_path, json_partitions):
+    failures = ManifestDataSet(str(tmp_path / "_failures.jsonl"))
+
+    json_partitions.save(iter([("a", {"x": 1}, {"source": "test"}), ("b", None, {"error": "boom"})]))
+    json_partitions.save(iter([("b", None, {"error": "boom"})]))
+    assert failures.load()["b"] == {"saved": pd.Timestamp.today().strftime("%Y-%m-%d"), "failures": 2, "error": "boom"}
+    assert sorted(json_partitions.load()) == ["a"]
+
+    json_partitions.save(iter([("b", {"x": 2})]))
+    assert failures.load()["b"]["failures"] == 0
+
+    manifest = ManifestDataSet(str(tmp_path / "_manifest.jsonl")).load()
+    assert manifest["a"]["source"] == "test"
+    assert {name: loader() for name, loader in json_partitions.load().items()} == {"a": {"x": 1}, "b": {"x": 2}}
+
+
+def test_partition_filters_select_on_manifest_entries(tmp_path, parquet_partitions):
+    parquet_partitions.save(
+        {"old": _prices(["2019-12-31"], [1.0]), "new": _prices(["2020-12-31", "2021-01-04"], [2.0, 3.0])}
+    )
+
+    recent = ParquetPartitionedDataSet(
+        path=str(tmp_path), partition_filters=[["max_date", ">=", "2021-01-01"]]
+    )
+    assert list(recent.load()) == ["new"]
+
+
+def test_parquet_concat_load(tmp_path, parquet_partitions):
+    parquet_partitions.save(
+        {"a": _prices(["2021-01-04", "2021-01-05"], [1.0, 2.0]), "b": _prices(["2021-01-05"], [3.0])}
+    )
+
+    for use_manifest in (False, True):
+        data = ParquetPartitionedDataSet(
+            path=str(tmp_path), columns=["Date", "Close"], concat=True, use_manifest=use_manifest
+        ).load()
+        data = data.sort_values(["symbol", "Date"], ignore_index=True)
+        assert list(data.columns) == ["Date", "Close", "symbol"]
+        assert list(data.symbol) == ["a", "a", "b"]
+        assert list(data.Close) == [1.0, 2.0, 3.0]
+
+
+def test_parquet_concat_load_reads_only_manifest_partitions(tmp_path, parquet_partitions):
+    parquet_partitions.save({"1": _prices(["2021-01-04"], [1.0]), "2": _prices(["2021-01-04"], [2.0])})
+    # written outside the dataset, so missing from the manifest
+    stray = tmp_path / "symbol=3"
+    stray.mkdir()
+    _prices(["2021-01-04"], [3.0]).reset_index().to_parquet(stray / "part.parquet")
+
+    data = ParquetPartitionedDataSet(path=str(tmp_path), concat=True, use_manifest=True).load()
+
+    assert sorted(data.symbol) == ["1", "2"]
+    assert ParquetPartitionedDataSet(path=str(tmp_path / "empty"), concat=True, use_manifest=True).load().empty
+
+
+def test_parquet_lazy_concat_reads_given_partitions(tmp_path, parquet_partitions):
+    parquet_partitions.save({name: _prices(["2021-01-04"], [close]) for name, close in [("a", 1.0), ("b", 2.0), ("c", 3.0)]})
+
+    read = ParquetPartitionedDataSet(path=str(tmp_path), concat=True, lazy=True, use_manifest=True).load()
+
+    assert sorted(read(partitions=["a", "c", "missing"]).symbol) == ["a", "c"]
+    assert read(partitions=[]).empty
+    assert list(read(columns=["Close"]).sort_values("symbol").Close) == [1.0, 2.0, 3.0]
+
+
+def _snapshot_partitions(path):
+    return SnapshotPartitionedDataSet(
+        path=str(path), dataset="json.JSONDataSet", filename_suffix=".json", use_manifest=True
+    )
+
+
+def test_snapshot_serves_partitions_with_matching_hash(tmp_path):
+    _snapshot_partitions(tmp_path).save({"a": {"price": 1}, "b": {"price": 2}})
+
+    # served from the snapshot, without opening the partition file
+    (tmp_path / "a.json").write_text("not json")
+    loaded = _snapshot_partitions(tmp_path).load()
+    assert {name: loader() for name, loader in loaded.items()} == {"a": {"price": 1}, "b": {"price": 2}}
+
+    # copies, so a caller modifying one does not change the next load
+    loaded["b"]()["price"] = 3
+    assert loaded["b"]() == {"price": 2}
+
+
+def test_snapshot_falls_back_to_partition_file_when_hash_differs(tmp_path):
+    _snapshot_partitions(tmp_path).save({"a": {"price": 1}})
+
+    # saved without updating the snapshot, which is now stale
+    StreamingPartitionedDataSet(
+        path=str(tmp_path), dataset="json.JSONDataSet", filename_suffix=".json", use_manifest=True
+    ).save({"a": {"price": 5}})
+
+    assert _snapshot_partitions(tmp_path).load()["a"]() == {"price": 5}
+
+
+def test_snapshot_is_compacted(tmp_path):
+    partitions = _snapshot_partitions(tmp_path)
+    for price in range(3):
+        partitions.save({"a": {"price": price}, "b": {"price": 0}})
+
+    # six entries, more than half superseded: one line per partition is kept
+    entries = [json.loads(line) for line in (tmp_path / "_snapshot.jsonl").read_text().splitlines()]
+    assert [(entry["partition"], entry["data"]) for entry in entries] == [("a", {"price": 2}), ("b", {"price": 0})]
+    assert partitions.load()["a"]() == {"price": 2}
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from investing.extras.datasets.partitioned_dataset import ManifestDataSet, row_hash_sum
+from investing.extras.datasets.timeseries_dataset import COLUMNS, OHLCVStoreDataSet, TimeSeries
+
+
+def _prices(dates, close):
+    close = np.asarray(close, dtype="float64")
+    return pd.DataFrame(
+        {"Open": close, "High": close + 1, "Low": close - 1, "Close": close, "Volume": close * 10, "Currency": "GBP"},
+        index=pd.Index(pd.to_datetime(dates), name="Date"),
+    )
+
+
+def _closes(series):
+    return dict(zip(series().Date.dt.strftime("%Y-%m-%d"), series().Close))
+
+
+def test_append_adds_new_days_and_replaces_last_day(tmp_path):
+    series = TimeSeries(tmp_path / "etf")
+    assert series.last_date() is None and series.first_date() is None
+    assert series().empty
+
+    assert series.append(_prices(["2021-01-04", "2021-01-05"], [1, 2])) == 2
+    # the last stored day re-sent, e.g. prices saved part way through the day
+    assert series.append(_prices(["2021-01-05", "2021-01-06"], [2.5, 3])) == 2
+
+    assert _closes(series) == {"2021-01-04": 1, "2021-01-05": 2.5, "2021-01-06": 3}
+    assert list(series().columns) == ["Date", *COLUMNS]
+    assert series.last_date() == pd.Timestamp("2021-01-06")
+
+
+def test_append_skips_unchanged_history(tmp_path):
+    series = TimeSeries(tmp_path / "etf")
+    series.append(_prices(["2021-01-04", "2021-01-05"], [1, 2]))
+
+    # the full history re-sent with one new day, as the download node does: only the last stored day is rewritten
+    assert series.append(_prices(["2021-01-04", "2021-01-05", "2021-01-06"], [1, 2, 3])) == 2
+    assert _closes(series) == {"2021-01-04": 1, "2021-01-05": 2, "2021-01-06": 3}
+
+
+def test_append_filling_a_gap_keeps_stored_history(tmp_path):
+    series = TimeSeries(tmp_path / "etf")
+    series.append(_prices(["2021-01-04", "2021-01-05", "2021-01-08"], [1, 2, 5]))
+
+    series.append(_prices(["2021-01-06", "2021-01-07"], [3, 4]))
+    assert _closes(series) == {"2021-01-04": 1, "2021-01-05": 2, "2021-01-06": 3, "2021-01-07": 4, "2021-01-08": 5}
+
+    # a revised earlier day, together with a new day
+    series.append(_prices(["2021-01-05", "2021-01-11"], [20, 6]))
+    assert _closes(series) == {
+        "2021-01-04": 1, "2021-01-05": 20, "2021-01-06": 3, "2021-01-07": 4, "2021-01-08": 5, "2021-01-11": 6
+    }
+    assert not list(tmp_path.glob(".*"))
+
+
+def test_slice_filters_and_latest_read_only_requested_rows(tmp_path):
+    series = TimeSeries(tmp_path / "etf")
+    series.append(_prices(pd.bdate_range("2021-01-04", periods=10), range(10)))
+
+    assert series.slice("2021-01-06", "2021-01-08").Close.tolist() == [2, 3, 4]
+    assert series.slice(start="2021-01-14").Close.tolist() == [8, 9]
+    assert series(columns=["Date", "Close"], filters=[("Date", ">", "2021-01-14")]).Close.tolist() == [9]
+    assert series(filters=[("Date", "==", pd.Timestamp("2021-01-05"))]).Close.tolist() == [1]
+    assert series(filters=[("Date", "<", "2021-01-01")]).empty
+
+    latest = series.latest()
+    assert (latest.Date.iloc[0], latest.Close.iloc[0]) == (pd.Timestamp("2021-01-15"), 9)
+    assert series.latest(3).Close.tolist() == [7, 8, 9]
+
+    with pytest.raises(ValueError):
+        series(filters=[("Close", ">", 1)])
+
+
+def test_interrupted_append_is_ignored(tmp_path):
+    series = TimeSeries(tmp_path / "etf")
+    series.append(_prices(["2021-01-04"], [1]))
+
+    # values written, killed before the dates were
+    with open(tmp_path / "etf" / "values.f8", "ab") as file:
+        file.write(np.ones(len(COLUMNS)).tobytes())
+
+    assert len(series) == 1
+    series.append(_prices(["2021-01-05"], [2]))
+    assert _closes(series) == {"2021-01-04": 1, "2021-01-05": 2}
+
+
+def test_store_records_manifest_and_failures(tmp_path):
+    store = OHLCVStoreDataSet(str(tmp_path))
+    store.save(iter([("a", _prices(["2021-01-04", "2021-01-05"], [1, 2]), {"source": "test"}), ("b", None, {"error": "boom"})]))
+    store.save({"a": _prices(["2021-01-05", "2021-01-06"], [2, 3])})
+
+    loaded = store.load()
+    assert sorted(loaded) == ["a"]
+    manifest = ManifestDataSet(str(tmp_path / "_manifest.jsonl")).load()
+    assert manifest["a"]["rows"] == 3
+    assert (manifest["a"]["min_date"], manifest["a"]["max_date"]) == ("2021-01-04", "2021-01-06")
+    # describes the series as read back, so readers can check the rows they processed
+    assert manifest["a"]["row_hash_sum"] == row_hash_sum(loaded["a"]())
+    assert ManifestDataSet(str(tmp_path / "_failures.jsonl")).load()["b"]["failures"] == 1
+
+
+def test_store_concat_and_column_loads(tmp_path):
+    OHLCVStoreDataSet(str(tmp_path)).save({"a": _prices(["2021-01-04"], [1]), "b": _prices(["2021-01-04"], [2])})
+
+    panel = OHLCVStoreDataSet(str(tmp_path), columns=["Date", "Close"], concat=True).load()
+    assert panel.to_dict("list") == {
+        "Date": [pd.Timestamp("2021-01-04")] * 2, "Close": [1.0, 2.0], "symbol": ["a", "b"]
+    }
+
+    loaders = OHLCVStoreDataSet(str(tmp_path), columns=["Date", "Close"]).load()
+    assert list(loaders["a"]().columns) == ["Date", "Close"]
+    assert OHLCVStoreDataSet(str(tmp_path / "missing"), concat=True).load().empty
+    assert list(loaders["a"](columns=["Date", "High"]).columns) == ["Date", "High"]
+
+
+def test_store_lazy_concat_reads_given_series(tmp_path):
+    OHLCVStoreDataSet(str(tmp_path)).save({"a": _prices(["2021-01-04"], [1]), "b": _prices(["2021-01-04"], [2])})
+
+    read = OHLCVStoreDataSet(str(tmp_path), concat=True, lazy=True).load()
+
+    assert list(read(partitions=["b", "missing"]).symbol) == ["b"]
+    assert read(partitions=[]).empty
+    assert list(read(columns=["Close"]).Close) == [1.0, 2.0]
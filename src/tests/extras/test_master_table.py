@@ -0,0 +1,79 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.errors import MergeError
+from pandas.testing import assert_frame_equal
+
+from investing.extras.master_table import MasterTable
+
+
+def _etf_tables():
+    etfs = pd.DataFrame({
+        "name": ["alpha", "beta", "gamma", "delta", None],
+        "symbol_ft": ["A", "B", "C", None, "E"],
+        "stock_exchange": ["London", "London", "Xetra", "London", "London"],
+    })
+    information = pd.DataFrame({"ETF Name": ["alpha", "gamma", None], "name": ["Alpha", "Gamma", "Nameless"]})
+    forecast = pd.DataFrame({"name": ["alpha", "beta"], "yhat": [1.0, 2.0]})
+    meta = pd.DataFrame({"name": ["alpha", "gamma", np.nan], "cagr": [0.1, 0.2, 0.3]})
+    holdings = pd.DataFrame({
+        "symbol_ft": ["A", "C", None], "stock_exchange": ["London", "London", "London"], "shares_held": [1, 2, 3]
+    })
+    return etfs, information, forecast, meta, holdings
+
+
+def test_left_joins_match_merge_chain():
+    etfs, information, forecast, meta, holdings = _etf_tables()
+
+    built = (
+        MasterTable(etfs)
+        .join(information, left_on=["name"], right_on=["ETF Name"], suffixes=("_source", ""))
+        .join(forecast, on=["name"], suffixes=("", "_forecast"))
+        .join(meta, on=["name"])
+        .join(holdings, on=["symbol_ft", "stock_exchange"])
+        .build()
+    )
+
+    merged = pd.merge(etfs, information, left_on="name", right_on="ETF Name", how="left", suffixes=("_source", ""))
+    merged = pd.merge(merged, forecast, on="name", how="left", suffixes=("", "_forecast"))
+    merged = pd.merge(merged, meta, on="name", how="left")
+    merged = pd.merge(merged, holdings, on=["symbol_ft", "stock_exchange"], how="left")
+
+    assert_frame_equal(built, merged)
+    # missing keys match each other, as in pandas, including those left missing by an earlier join
+    assert built.name.tolist()[3:] == [np.nan, "Nameless"]
+    assert built.cagr.tolist()[3] == 0.3
+    assert built.shares_held.tolist()[3] == 3
+
+
+def test_inner_join_matches_merge():
+    ft = pd.DataFrame({"isin": ["X1", "X2", "X3", None], "currency": ["GBP", "GBP", "USD", "GBP"], "mic": list("abcd")})
+    etfs = pd.DataFrame({"isin": ["X1", "X3", None], "currency": ["GBP", "GBP", "GBP"], "name": ["one", "three", "none"]})
+
+    built = MasterTable(ft).join(etfs, on=["isin", "currency"], how="inner", suffixes=("_ft", "")).build()
+    merged = pd.merge(ft, etfs, on=["isin", "currency"], how="inner", suffixes=("_ft", ""))
+
+    assert_frame_equal(built, merged)
+
+
+def test_duplicated_keys_raise_as_many_to_one_merge():
+    ft = pd.DataFrame({"isin": ["X1", "X2"]})
+    etfs = pd.DataFrame({"isin": ["X1", "X1", "X2"], "name": ["first", "second", "two"]})
+
+    with pytest.raises(MergeError):
+        pd.merge(ft, etfs, on=["isin"], how="inner", validate="many_to_one")
+    with pytest.raises(MergeError, match="not unique"):
+        MasterTable(ft).join(etfs, on=["isin"], how="inner").build()
+
+
+def test_duplicated_keys_join_first_row_with_warning(caplog):
+    ft = pd.DataFrame({"isin": ["X1", "X2"]})
+    etfs = pd.DataFrame({"isin": ["X1", "X1", "X2"], "name": ["first", "second", "two"]})
+
+    with caplog.at_level(logging.WARNING):
+        built = MasterTable(ft).join(etfs, on=["isin"], how="inner", take_first=True).build()
+
+    assert built.name.tolist() == ["first", "two"]
+    assert "not unique" in caplog.text
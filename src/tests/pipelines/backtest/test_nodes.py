@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from investing.pipelines.backtest.nodes import RESULT_COLUMNS, backtest_buy_sell
+
+BACKTEST_PARAMS = {'max_positions': 1, 'grid': {'min_age': [1, 100], 'volatility_factor': [0.5]}}
+INFORMATION = pd.DataFrame({'name': ['a', 'b'], 'Dividend Yield': ['1%', None]})
+
+
+def _panel(dates):
+    '''ETF a is bought on the first day and never sold, with no price on the third day; b is never bought'''
+    index = pd.DatetimeIndex(dates, name='Date')
+    n = len(index)
+
+    def frame(a, b):
+        return pd.DataFrame({'a': a, 'b': b}, index=index, dtype='float64')
+
+    return {
+        'close': frame([10, 11, np.nan, 12.1][:n], [20] * n),
+        'day_low': frame([9] * n, [20] * n),
+        'day_high': frame([11] * n, [20] * n),
+        'yhat_lower': frame([9.5] * n, [19] * n),
+        'yhat_upper': frame([100] * n, [100] * n),
+        'age': frame([5] * n, [5] * n),
+        'volatility': frame([0.2] * n, [0.2] * n),
+    }
+
+
+def test_backtest_matches_hand_computed_returns():
+    results = backtest_buy_sell(_panel(pd.date_range('2021-01-01', periods=4)), INFORMATION, BACKTEST_PARAMS)
+
+    # a is held from the close of the first day, through the missing price: daily returns 0, 10%, 0, 10%
+    years = 3 / 365.25
+    best = results.iloc[0]
+    assert (best.min_age, best.volatility_factor) == (1, 0.5)
+    assert best.total_return == pytest.approx(0.21)
+    assert best.cagr == pytest.approx(1.21 ** (1 / years) - 1)
+    assert best.annual_volatility == pytest.approx(np.std([0, 0.1, 0, 0.1]) * 252 ** 0.5)
+    assert best.max_drawdown == 0
+    assert best.annual_turnover == pytest.approx(0.5 / years)
+    assert (best.avg_positions, best.trades, best.hit_rate) == (1, 1, 1)
+
+    # too young to buy: nothing traded
+    never = results.iloc[1]
+    assert (never.min_age, never.total_return, never.cagr, never.trades) == (100, 0, 0, 0)
+    assert list(results.columns) == RESULT_COLUMNS
+
+
+def test_backtest_without_prices_is_empty():
+    results = backtest_buy_sell(_panel([]), INFORMATION, BACKTEST_PARAMS)
+
+    assert results.empty
+    assert list(results.columns) == RESULT_COLUMNS
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from investing.pipelines.data_extraction.download import Downloader, TokenBucket
+
+
+def _downloader(**params):
+    return Downloader(
+        {'max_workers': 2, 'max_retries': 2, 'backoff_base': 0.001, 'backoff_max': 0.01,
+         'rate_per_second': 1000, 'burst': 1000, **params},
+        'test',
+    )
+
+
+def test_token_bucket_limits_rate_after_burst():
+    bucket = TokenBucket(rate=20, capacity=2)
+
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+
+    # 2 tokens at once, then one every 1/20s
+    assert time.monotonic() - start >= 4 / 20 * 0.9
+
+
+def test_request_retries_with_backoff_then_succeeds():
+    calls = []
+
+    def flaky():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise ConnectionError('rate limited')
+        return 'data'
+
+    assert _downloader().request(flaky) == 'data'
+    assert len(calls) == 3
+
+
+def test_request_raises_once_retries_are_exhausted():
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise ConnectionError('down')
+
+    with pytest.raises(ConnectionError):
+        _downloader(max_retries=1).request(failing)
+    assert len(calls) == 2
+
+
+def test_map_isolates_failures_and_skips_empty_results():
+    def fail():
+        raise ValueError('bad symbol')
+
+    tasks = {'a': lambda: 1, 'bad': fail, 'none': lambda: None, 'b': lambda: 2}
+
+    assert dict(_downloader().map(tasks)) == {'a': 1, 'b': 2}
+
+
+def test_map_bounds_requests_in_flight():
+    lock = threading.Lock()
+    running, started, peak = [0], [0], [0]
+
+    def task():
+        with lock:
+            running[0] += 1
+            started[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return 1
+
+    results = _downloader().map({str(i): task for i in range(20)})
+    next(results)
+
+    # results not consumed yet hold back further tasks: at most twice max_workers queued
+    assert started[0] <= 4
+    assert len(list(results)) == 19
+    assert peak[0] <= 2
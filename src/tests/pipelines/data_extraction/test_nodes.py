@@ -0,0 +1,76 @@
+import pandas as pd
+
+from investing.pipelines.data_extraction.nodes import _download_historical
+
+
+class _Downloader:
+    def __init__(self, data):
+        self.data = data
+        self.requests = []
+
+    def request(self, func, *args, **kwargs):
+        self.requests.append(kwargs)
+        return self.data
+
+
+def _history(dates):
+    return pd.DataFrame({"Close": range(len(dates))}, index=pd.Index(pd.to_datetime(dates), name="Date"))
+
+
+def _row():
+    return pd.Series({"name": "Some ETF", "country": "united kingdom", "stock_exchange": "London"})
+
+
+def _entry(max_date, saved):
+    return {"max_date": max_date, "saved": saved}
+
+
+def test_download_historical_requests_from_last_stored_date():
+    stored = _history(["2021-01-04", "2021-01-05"]).reset_index()
+    downloader = _Downloader(_history(["2021-01-05", "2021-01-06"]))
+
+    data = _download_historical(
+        downloader, _row(), lambda: stored, _entry("2021-01-05", "2021-01-06"), "01/01/2000", pd.Timestamp("2021-01-07")
+    )
+
+    assert downloader.requests[0]["from_date"] == "05/01/2021"
+    assert list(data.index.strftime("%Y-%m-%d")) == ["2021-01-04", "2021-01-05", "2021-01-06"]
+
+
+def test_download_historical_refreshes_a_day_saved_during_trading():
+    stored = _history(["2021-01-06", "2021-01-07"]).reset_index()
+    downloader = _Downloader(_history(["2021-01-06", "2021-01-07"]))
+
+    data = _download_historical(
+        downloader, _row(), lambda: stored, _entry("2021-01-07", "2021-01-07"), "01/01/2000", pd.Timestamp("2021-01-07")
+    )
+
+    assert (downloader.requests[0]["from_date"], downloader.requests[0]["to_date"]) == ("06/01/2021", "07/01/2021")
+    assert len(data) == 2
+
+
+def test_download_historical_skips_up_to_date_history_without_reading_it():
+    def unread():
+        raise AssertionError("stored history read")
+
+    downloader = _Downloader(None)
+
+    # Friday's prices saved on Saturday: nothing new until Monday
+    entry = _entry("2021-01-08", "2021-01-09")
+    assert _download_historical(downloader, _row(), unread, entry, "01/01/2000", pd.Timestamp("2021-01-10")) is None
+    assert not downloader.requests
+
+
+def test_download_historical_falls_back_to_full_download_on_unreadable_partition():
+    def corrupt():
+        raise OSError("Invalid parquet file, truncated")
+
+    full = _history(["2021-01-04", "2021-01-05"])
+    downloader = _Downloader(full)
+
+    data = _download_historical(
+        downloader, _row(), corrupt, _entry("2021-01-04", "2021-01-05"), "01/01/2000", pd.Timestamp("2021-01-07")
+    )
+
+    assert downloader.requests[0]["from_date"] == "01/01/2000"
+    assert data is full
@@ -0,0 +1,60 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from investing.extras.datasets.partitioned_dataset import ManifestDataSet, ParquetPartitionedDataSet
+from investing.pipelines.prophet_model.band import band_forecast, fit_band_models
+
+
+@pytest.fixture
+def historical(tmp_path):
+    dates = pd.bdate_range('2018-01-01', periods=800, name='Date')
+    t = np.arange(len(dates)) / 252
+    rng = np.random.default_rng(0)
+    dataset = ParquetPartitionedDataSet(path=str(tmp_path), date_columns=['Date'], use_manifest=True)
+    dataset.save({
+        'up': pd.DataFrame({'Close': np.exp(4 + 0.1 * t + rng.normal(0, 0.01, len(t)))}, index=dates),
+        # listed on fewer dates
+        'down': pd.DataFrame({'Close': np.exp(3 - 0.2 * t[::2])}, index=dates[::2]),
+    })
+    return dataset.load(), ManifestDataSet(str(tmp_path / '_manifest.jsonl')).load()
+
+
+def test_band_models_read_only_the_window(historical):
+    datasets, manifest = historical
+    band_params = {'window': 252, 'min_rows': 60, 'interval_width': 0.8}
+
+    read = []
+
+    def _counting(loader):
+        def _load(**kwargs):
+            data = loader(**kwargs)
+            read.append(len(data))
+            return data
+        return _load
+
+    counted = {name: _counting(loader) for name, loader in datasets.items()}
+    models = {name: json.loads(model) for name, model, _ in fit_band_models(counted, manifest, band_params)}
+    full = {name: json.loads(model) for name, model, _ in fit_band_models(datasets, {}, band_params)}
+
+    assert models == full
+    assert sum(read) < 800
+    # slopes per calendar year, of trends per 252 business days
+    years = 365.25 * 5 / 7 / 252
+    assert models['up']['slope'] == pytest.approx(0.1 * years, rel=0.05)
+    assert models['down']['slope'] == pytest.approx(-0.2 * years, rel=0.01)
+
+    forecast = band_forecast(models['up'], pd.DatetimeIndex([models['up']['last_date']]), ['yhat_lower', 'yhat_upper'])
+    assert (forecast.yhat_lower < forecast.yhat_upper).all()
+
+
+def test_band_models_without_series(tmp_path):
+    band_params = {'window': 252, 'min_rows': 60, 'interval_width': 0.8}
+
+    assert list(fit_band_models({}, {}, band_params)) == []
+
+    empty = ParquetPartitionedDataSet(path=str(tmp_path), date_columns=['Date'])
+    empty.save({'new': pd.DataFrame({'Close': []}, index=pd.DatetimeIndex([], name='Date'))})
+    assert list(fit_band_models(empty.load(), {}, band_params)) == []
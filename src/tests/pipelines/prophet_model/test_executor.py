@@ -0,0 +1,53 @@
+import time
+from pathlib import Path
+
+import pytest
+
+from investing.pipelines.prophet_model.executor import imap_isolated
+
+
+@pytest.fixture
+def executor_params():
+    return {'workers': 2, 'maxtasksperchild': 2, 'timeout': 2, 'retries': 1}
+
+
+def _square(item):
+    name, value = item
+    if value is None:
+        raise ValueError(f"no value for {name}")
+    if value == 'slow':
+        time.sleep(60)
+    return value ** 2
+
+
+def _flaky(item):
+    '''Fails on the first attempt, leaving a marker file, and succeeds on the next'''
+    name, marker = item
+    if not Path(marker).exists():
+        Path(marker).touch()
+        raise RuntimeError('first attempt')
+    return name
+
+
+def test_failing_series_does_not_affect_others(executor_params):
+    items = {'a': ('a', 2), 'bad': ('bad', None), 'c': ('c', 3)}
+
+    results = {name: (result, error) for name, result, error in imap_isolated(_square, items, executor_params)}
+
+    assert results == {'a': (4, None), 'c': (9, None), 'bad': (None, 'ValueError: no value for bad')}
+
+
+def test_failed_series_is_retried(tmp_path, executor_params):
+    items = {'a': ('a', str(tmp_path / 'a'))}
+
+    assert list(imap_isolated(_flaky, items, executor_params)) == [('a', 'a', None)]
+
+
+def test_series_exceeding_timeout_fails_and_others_complete(executor_params):
+    items = {'slow': ('slow', 'slow'), 'a': ('a', 2), 'b': ('b', 3)}
+
+    start = time.time()
+    results = {name: (result, error) for name, result, error in imap_isolated(_square, items, executor_params)}
+
+    assert results == {'a': (4, None), 'b': (9, None), 'slow': (None, 'TimeoutError: exceeded 2s')}
+    assert time.time() - start < 30
@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip('fbprophet')
+
+from investing.pipelines.prophet_model import nodes  # noqa: E402
+
+PROPHET_PARAMS = {
+    'backend': 'prophet',
+    'model': {},
+    'lookback_years': None,
+    'resample': None,
+    'columns': ['yhat', 'yhat_lower', 'yhat_upper'],
+    'warm_start': True,
+    'drift': {'enabled': False},
+    'executor': {'quarantine_after': 3, 'quarantine_days': 7},
+}
+
+
+@pytest.fixture
+def dispatched(monkeypatch):
+    '''Items sent to the executor, which runs nothing'''
+    sent = {}
+
+    def imap_tasks(func, items, executor_params):
+        sent.update(items)
+        return iter([])
+
+    monkeypatch.setattr(nodes, 'imap_tasks', imap_tasks)
+    return sent
+
+
+def test_unchanged_series_are_not_dispatched(dispatched):
+    data_manifest = {'same': {'hash': 'aaa'}, 'changed': {'hash': 'new'}, 'unhashed': {}}
+    stored = {
+        'same': {'input_hash': nodes._input_hash({'hash': 'aaa'}, PROPHET_PARAMS)},
+        'changed': {'input_hash': nodes._input_hash({'hash': 'old'}, PROPHET_PARAMS)},
+    }
+    datasets = {name: None for name in data_manifest}
+
+    list(nodes.fit_prophet_models(datasets, data_manifest, stored, {}, {}, PROPHET_PARAMS))
+    assert sorted(dispatched) == ['changed', 'unhashed']
+    assert dispatched['changed'][2] == nodes._input_hash({'hash': 'new'}, PROPHET_PARAMS)
+
+    # a changed model configuration refits every series
+    dispatched.clear()
+    params = {**PROPHET_PARAMS, 'lookback_years': 5}
+    list(nodes.fit_prophet_models(datasets, data_manifest, stored, {}, {}, params))
+    assert sorted(dispatched) == ['changed', 'same', 'unhashed']
+
+
+def test_predict_dates_without_models_is_empty():
+    predictions = nodes.predict_prophet_dates({}, {}, PROPHET_PARAMS, {'dates': ['2021-01-04']})
+
+    assert predictions.empty
+    assert list(predictions.columns) == ['ds', 'yhat', 'yhat_lower', 'yhat_upper', 'name']
+
+
+def test_evaluation_with_every_series_failing_is_empty(monkeypatch):
+    monkeypatch.setattr(nodes, 'imap_tasks', lambda func, items, params: ((name, None, 'boom') for name in items))
+
+    report = nodes.evaluate_training_windows({'a': None}, PROPHET_PARAMS, {'sample': 1, 'variants': {}})
+
+    assert report.empty
+    assert 'variant' in report
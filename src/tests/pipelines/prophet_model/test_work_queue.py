@@ -0,0 +1,97 @@
+import pickle
+import sqlite3
+import time
+from contextlib import closing
+from multiprocessing import Process
+
+import pytest
+
+from investing.pipelines.prophet_model import work_queue as work_queue_module
+from investing.pipelines.prophet_model.work_queue import WorkQueue, _run_in_child, serve
+
+
+def _double(item):
+    name, value = item
+    if value == 'slow':
+        time.sleep(60)
+    return value * 2
+
+
+@pytest.fixture
+def work_queue(tmp_path):
+    return WorkQueue(str(tmp_path / 'queue.sqlite'))
+
+
+def _corrupt(work_queue, name):
+    with closing(sqlite3.connect(str(work_queue.path))) as db, db:
+        db.execute("UPDATE tasks SET payload = x'00' WHERE name = ?", (name,))
+
+
+def test_claim_run_complete_collect(work_queue):
+    run = work_queue.publish(_double, {'a': ('a', 1), 'b': ('b', 2)}, max_attempts=1, lease_seconds=10)
+
+    while True:
+        task = work_queue.claim('test')
+        if task is None:
+            break
+        task_run, name, payload, lease_seconds = task
+        assert (task_run, lease_seconds) == (run, 10)
+        work_queue.complete(run, name, *_run_in_child(payload, lease_seconds))
+
+    assert sorted(work_queue.collect(run, poll_seconds=0.01)) == [('a', 2, None), ('b', 4, None)]
+
+
+def test_failed_task_is_retried_until_max_attempts(work_queue):
+    run = work_queue.publish(_double, {'a': ('a', 1)}, max_attempts=2, lease_seconds=10)
+
+    for _ in range(2):
+        _, name, _, _ = work_queue.claim('test')
+        work_queue.complete(run, name, error='ValueError: bad')
+
+    assert work_queue.claim('test') is None
+    assert list(work_queue.collect(run, poll_seconds=0.01)) == [('a', None, 'ValueError: bad')]
+
+
+def test_expired_lease_is_claimed_again_then_fails(work_queue, monkeypatch):
+    monkeypatch.setattr(work_queue_module, 'LEASE_GRACE_SECONDS', 0)
+    run = work_queue.publish(_double, {'a': ('a', 1)}, max_attempts=2, lease_seconds=0.05)
+
+    assert work_queue.claim('dead')[1] == 'a'
+    time.sleep(0.1)
+    assert work_queue.claim('also dead')[1] == 'a'
+    time.sleep(0.1)
+
+    # expired again without attempts left: failed by the collecting pipeline, with no worker running
+    assert list(work_queue.collect(run, poll_seconds=0.01)) == [('a', None, 'TimeoutError: lease expired')]
+
+
+def test_collect_fails_tasks_after_run_timeout(work_queue):
+    run = work_queue.publish(_double, {'a': ('a', 1)}, max_attempts=1, lease_seconds=10)
+
+    assert list(work_queue.collect(run, poll_seconds=0.01, run_timeout=0.1)) == [
+        ('a', None, 'TimeoutError: run exceeded 0.1s')
+    ]
+
+
+def test_task_in_child_fails_alone():
+    assert _run_in_child(pickle.dumps((_double, ('a', 1))), 10) == (2, None)
+    assert _run_in_child(b'\x00', 10)[1].startswith('UnpicklingError')
+    assert _run_in_child(pickle.dumps((_double, ('slow', 'slow'))), 0.5) == (None, 'TimeoutError: exceeded 0.5s')
+
+
+def test_worker_survives_bad_and_hung_tasks(work_queue):
+    items = {'bad': ('bad', 1), 'slow': ('slow', 'slow'), 'good': ('good', 3)}
+    run = work_queue.publish(_double, items, max_attempts=1, lease_seconds=1)
+    _corrupt(work_queue, 'bad')
+
+    worker = Process(target=serve, args=(str(work_queue.path), 0.01))
+    worker.start()
+    try:
+        results = {name: (result, error) for name, result, error in work_queue.collect(run, 0.01, run_timeout=30)}
+    finally:
+        worker.terminate()
+        worker.join()
+
+    assert results['good'] == (6, None)
+    assert results['slow'] == (None, 'TimeoutError: exceeded 1.0s')
+    assert results['bad'][1].startswith('UnpicklingError')
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from investing.extras.datasets.partitioned_dataset import ManifestDataSet, ParquetPartitionedDataSet
+from investing.pipelines.reporting.nodes import extract_prophet_output, update_historical_meta
+
+REPORT_PARAMS = {
+    'historical_metrics': ['volatility', 'age', 'day_low', 'day_high', 'cagr', 'max_drawdown', 'annual_stdev', 'avg_volume'],
+    'metric_years': 2,
+}
+
+
+def _prices(start, periods, seed):
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, periods)))
+    return pd.DataFrame(
+        {'Open': close, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close, 'Volume': rng.integers(1, 1000, periods)},
+        index=pd.bdate_range(start, periods=periods, name='Date'),
+    )
+
+
+class _Store:
+    '''etf_historical(_reader) and etf_metrics_state as catalogued: Parquet partitions listed from their manifests'''
+
+    def __init__(self, path):
+        self.historical = ParquetPartitionedDataSet(path=str(path / 'historic'), date_columns=['Date'], use_manifest=True)
+        self.reader = ParquetPartitionedDataSet(path=str(path / 'historic'), concat=True, lazy=True, use_manifest=True)
+        self.manifest = ManifestDataSet(str(path / 'historic' / '_manifest.jsonl'))
+        self.state = ParquetPartitionedDataSet(
+            path=str(path / 'state'), date_columns=['first_date', 'last_date'], use_manifest=True
+        )
+        self.state_stored = ParquetPartitionedDataSet(path=str(path / 'state'), concat=True, use_manifest=True)
+
+    def update(self):
+        meta, updated = update_historical_meta(
+            self.historical.load(), self.reader.load(), self.manifest.load(), self.state_stored.load(), REPORT_PARAMS
+        )
+        self.state.save(iter(updated))
+        return meta, updated
+
+    def rebuild(self):
+        return update_historical_meta(
+            self.historical.load(), self.reader.load(), self.manifest.load(), pd.DataFrame(), REPORT_PARAMS
+        )[0]
+
+
+def test_incremental_metrics_match_full_rebuild(tmp_path, caplog):
+    store = _Store(tmp_path)
+    full = {name: _prices('2018-01-01', 900, seed) for seed, name in enumerate(['appended', 'revised', 'same'])}
+    store.historical.save({name: prices.iloc[:800] for name, prices in full.items()})
+    store.update()
+
+    revised = full['revised'].iloc[:850].copy()
+    revised.iloc[10, revised.columns.get_loc('Close')] *= 2  # an earlier price revised
+    store.historical.save({'appended': full['appended'], 'revised': revised})
+
+    caplog.clear()
+    with caplog.at_level('INFO'):
+        meta, updated = store.update()
+
+    assert '1 updated, 1 rebuilt, 1 unchanged' in caplog.text
+    assert sorted(name for name, _ in updated) == ['appended', 'revised']
+    pd.testing.assert_frame_equal(meta, store.rebuild())
+    # and again from the saved states, with nothing new
+    meta, updated = store.update()
+    assert updated == []
+    pd.testing.assert_frame_equal(meta, store.rebuild())
+
+    # revised without new prices
+    same = full['same'].iloc[:800].copy()
+    same.iloc[-5, same.columns.get_loc('Low')] /= 2
+    store.historical.save({'same': same})
+    meta, updated = store.update()
+    assert [name for name, _ in updated] == ['same']
+    pd.testing.assert_frame_equal(meta, store.rebuild())
+
+
+def test_day_range_reported_when_not_configured(tmp_path):
+    store = _Store(tmp_path)
+    prices = _prices('2021-01-01', 30, 0)
+    store.historical.save({'etf': prices})
+
+    params = {**REPORT_PARAMS, 'historical_metrics': ['volatility', 'age']}
+    meta, _ = update_historical_meta(
+        store.historical.load(), store.reader.load(), store.manifest.load(), pd.DataFrame(), params
+    )
+
+    assert list(meta.columns) == ['name', 'volatility', 'age', 'day_low', 'day_high']
+    assert meta.day_low.iloc[0] == pytest.approx(prices.Low.iloc[-1])
+
+
+def test_rebuilds_read_once(tmp_path):
+    store = _Store(tmp_path)
+    store.historical.save({name: _prices('2020-01-01', 300, seed) for seed, name in enumerate(['a', 'b', 'c'])})
+
+    reads = []
+
+    def reader(partitions):
+        reads.append(sorted(partitions))
+        return store.reader.load()(partitions=partitions)
+
+    meta, updated = update_historical_meta(
+        store.historical.load(), reader, store.manifest.load(), pd.DataFrame(), REPORT_PARAMS
+    )
+
+    assert reads == [['a', 'b', 'c']]
+    assert sorted(name for name, _ in updated) == ['a', 'b', 'c']
+    assert list(meta.name) == ['a', 'b', 'c']
+
+
+def _snapshot(forecasts):
+    return pd.DataFrame(
+        [(pd.Timestamp(ds), yhat, name) for name, dates in forecasts.items() for ds, yhat in dates.items()],
+        columns=['ds', 'yhat', 'name'],
+    )
+
+
+def test_forecast_output_on_exact_date(caplog):
+    snapshot = _snapshot({
+        'a': {'2021-01-04': 1.0, '2021-01-05': 2.0},
+        'b': {'2021-01-04': 3.0, '2021-01-05': 4.0},
+    })
+
+    with caplog.at_level('WARNING'):
+        fcast = extract_prophet_output(snapshot, '2021-01-05')
+
+    assert fcast.set_index('name').yhat.to_dict() == {'a': 2.0, 'b': 4.0}
+    assert (fcast.ds == pd.Timestamp('2021-01-05')).all()
+    assert 'no data' not in caplog.text
+
+
+def test_forecast_output_on_weekend_uses_nearest_date(caplog):
+    # 'a' forecasts business days only, 'b' stops on the Friday (e.g. a backfilled run)
+    snapshot = _snapshot({
+        'a': {'2021-01-08': 1.0, '2021-01-11': 2.0},
+        'b': {'2021-01-07': 3.0, '2021-01-08': 4.0},
+    })
+
+    with caplog.at_level('WARNING'):
+        fcast = extract_prophet_output(snapshot, '2021-01-10')
+
+    assert fcast.set_index('name').ds.to_dict() == {'a': pd.Timestamp('2021-01-11'), 'b': pd.Timestamp('2021-01-08')}
+    assert 'no data for 2021-01-10' in caplog.text
+    assert 'a (2021-01-11)' in caplog.text
+
+
+def test_forecast_output_from_empty_snapshot():
+    snapshot = pd.DataFrame({'ds': pd.Series(dtype='datetime64[ns]'), 'yhat': pd.Series(dtype='float32'), 'name': []})
+
+    fcast = extract_prophet_output(snapshot, None)
+
+    assert fcast.empty
+    assert list(fcast.columns) == ['ds', 'yhat', 'name']